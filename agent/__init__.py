@@ -10,4 +10,11 @@ __all__ = [
     "uploader",
     "service",
     "logging_config",
+    "governor",
+    "bench",
+    "synthetic",
+    "journal",
+    "packer",
+    "retention",
+    "netscan",
 ]
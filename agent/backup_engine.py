@@ -6,49 +6,96 @@ from pathlib import Path
 import tarfile
 import time
 import hashlib
-from typing import Iterable
+from typing import Iterable, Optional
 
 from .logging_config import setup_logging
 from .encryption import encrypt_file
+from .governor import ResourceGovernor, ThrottledReader
+from .journal import JobJournal, sha256_file
+from .netscan import scan_tree, parallel_copytree
 
 logger = setup_logging()
 
 
 def _hash_dir(path: Path) -> str:
+    # scandir metadata: no per-file stat round trips on network shares
     h = hashlib.sha256()
-    for fp in sorted([p for p in path.rglob("*") if p.is_file()], key=lambda p: str(p)):
-        h.update(str(fp.relative_to(path)).encode())
-        h.update(str(fp.stat().st_mtime).encode())
-        h.update(str(fp.stat().st_size).encode())
+    for rel, (size, mtime) in sorted(scan_tree(path).items()):
+        h.update(rel.encode())
+        h.update(str(mtime).encode())
+        h.update(str(size).encode())
     return h.hexdigest()
 
 
-def safe_copy_company(src: Path, dst_root: Path) -> Path:
+def _throttled_copy(governor: ResourceGovernor):
+    def copy(src, dst):
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            shutil.copyfileobj(ThrottledReader(fsrc, governor), fdst, 1024 * 1024)
+        shutil.copystat(src, dst)
+        return dst
+
+    return copy
+
+
+def copy_file(src: Path, dst: Path, governor: Optional[ResourceGovernor] = None) -> Path:
+    """Copy one file with its metadata, charging reads to ``governor`` when given."""
+    if governor is None:
+        return Path(shutil.copy2(src, dst))
+    return Path(_throttled_copy(governor)(src, dst))
+
+
+def safe_copy_company(src: Path, dst_root: Path, governor: Optional[ResourceGovernor] = None, network_share: bool = False) -> Path:
     dst = dst_root / src.name
     if dst.exists():
         shutil.rmtree(dst)
     logger.info("Copying %s -> %s", src, dst)
-    shutil.copytree(src, dst, symlinks=False)
+    if network_share:
+        return parallel_copytree(src, dst, governor=governor)
+    copy_function = _throttled_copy(governor) if governor else shutil.copy2
+    shutil.copytree(src, dst, symlinks=False, copy_function=copy_function)
     return dst
 
 
-def compress_directory(src: Path, out_file: Path) -> None:
-    logger.info("Creating archive %s from %s", out_file, src)
-    with tarfile.open(out_file, "w:gz") as tar:
-        tar.add(src, arcname=src.name)
+def compress_directory(src: Path, out_file: Path, governor: Optional[ResourceGovernor] = None, compression_level: int = 9) -> None:
+    logger.info("Creating archive %s from %s (level %d)", out_file, src, compression_level)
+    with tarfile.open(out_file, "w:gz", compresslevel=compression_level) as tar:
+        if governor is None:
+            tar.add(src, arcname=src.name)
+            return
+        tar.addfile(tar.gettarinfo(str(src), arcname=src.name))
+        for fp in sorted(src.rglob("*"), key=lambda p: str(p)):
+            arcname = f"{src.name}/{fp.relative_to(src).as_posix()}"
+            info = tar.gettarinfo(str(fp), arcname=arcname)
+            if fp.is_file():
+                with open(fp, "rb") as f:
+                    tar.addfile(info, ThrottledReader(f, governor))
+            else:
+                tar.addfile(info)
 
 
-def create_encrypted_backup(company_dir: Path, password: bytes, dest_dir: Path) -> Path:
+def create_encrypted_backup(
+    company_dir: Path,
+    password: bytes,
+    dest_dir: Path,
+    governor: Optional[ResourceGovernor] = None,
+    compression_level: int = 9,
+    journal: Optional[JobJournal] = None,
+    network_share: bool = False,
+) -> Path:
     dest_dir.mkdir(parents=True, exist_ok=True)
+    if journal is not None:
+        return _journaled_backup(company_dir, password, dest_dir, journal, governor, compression_level, network_share)
     with tempfile.TemporaryDirectory() as td:
         td_path = Path(td)
-        copied = safe_copy_company(company_dir, td_path)
+        copied = safe_copy_company(company_dir, td_path, governor=governor, network_share=network_share)
 
         # Basic integrity: hash before compression
         before_hash = _hash_dir(copied)
 
         archive = dest_dir / f"{company_dir.name}.tar.gz"
-        compress_directory(copied, archive)
+        compress_directory(copied, archive, governor=governor, compression_level=compression_level)
+        if governor:
+            governor.wait_if_busy()
 
         # Optional verify by decompressing to temp and hashing (skipped expensive step for big datasets)
         enc_path = dest_dir / f"backup_{time.strftime('%Y-%m-%d_%H-%M')}_{company_dir.name}.enc"
@@ -56,3 +103,49 @@ def create_encrypted_backup(company_dir: Path, password: bytes, dest_dir: Path)
 
         logger.info("Created encrypted backup %s (source-hash=%s)", enc_path, before_hash)
         return enc_path
+
+
+def _journaled_backup(
+    company_dir: Path,
+    password: bytes,
+    dest_dir: Path,
+    journal: JobJournal,
+    governor: Optional[ResourceGovernor],
+    compression_level: int,
+    network_share: bool = False,
+) -> Path:
+    """Same pipeline as ``create_encrypted_backup`` but checkpointed after every stage.
+
+    The copy lives in a persistent work dir instead of a TemporaryDirectory so it
+    survives a restart.
+    """
+    work = dest_dir / ".work" / company_dir.name
+    source_hash = _hash_dir(company_dir)
+    if not journal.begin(source_hash) and work.exists():
+        shutil.rmtree(work)
+
+    archive = dest_dir / f"{company_dir.name}.tar.gz"
+    copied = work / company_dir.name
+    if journal.completed("compress") is None:
+        done = journal.completed("copy")
+        if done is None or not copied.exists() or _hash_dir(copied) != done["hash"]:
+            work.mkdir(parents=True, exist_ok=True)
+            copied = safe_copy_company(company_dir, work, governor=governor, network_share=network_share)
+            journal.record("copy", path=str(copied), hash=_hash_dir(copied))
+        compress_directory(copied, archive, governor=governor, compression_level=compression_level)
+        journal.record("compress", path=str(archive), sha256=sha256_file(archive))
+        # The archive is checkpointed; the copy is no longer needed
+        shutil.rmtree(work, ignore_errors=True)
+        if governor:
+            governor.wait_if_busy()
+
+    done = journal.completed("encrypt")
+    if done is not None:
+        enc_path = Path(done["path"])
+        logger.info("Reusing encrypted backup %s from interrupted run", enc_path)
+        return enc_path
+    enc_path = dest_dir / f"backup_{time.strftime('%Y-%m-%d_%H-%M')}_{company_dir.name}.enc"
+    encrypt_file(archive, enc_path, password)
+    journal.record("encrypt", path=str(enc_path), sha256=sha256_file(enc_path))
+    logger.info("Created encrypted backup %s (source-hash=%s)", enc_path, source_hash)
+    return enc_path
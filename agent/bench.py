@@ -0,0 +1,334 @@
+"""`agent bench`: measure this machine and uplink, then tune backup settings.
+
+Each stage (read, compress, encrypt, upload) is timed in isolation on a sample
+of the real company data. A simple pipeline model then picks the compression
+level, multipart part size, upload concurrency and number of parallel backup
+workers that minimise estimated end-to-end backup time within a CPU budget.
+The result is written into config.json for the service to pick up.
+"""
+from __future__ import annotations
+
+import io
+import os
+import time
+import zlib
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import boto3
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from .logging_config import setup_logging
+from .encryption import derive_key_from_password
+from .uploader import make_transfer_config
+
+logger = setup_logging()
+
+MB = 1024 * 1024
+COMPRESSION_LEVELS = [1, 3, 6, 9]
+PART_SIZES_MB = [8, 16, 32, 64]
+CONCURRENCIES = [2, 4, 8, 16]
+
+
+class BenchError(Exception):
+    pass
+
+
+@dataclass
+class BenchResult:
+    total_bytes: int
+    companies: int
+    read_bps: float
+    compress_bps: Dict[int, float]
+    compress_ratio: Dict[int, float]
+    encrypt_bps: float
+    kdf_seconds: float
+    upload_bps: Dict[Tuple[int, int], float]
+
+
+@dataclass
+class TunedSettings:
+    compression_level: int
+    # None when the probe budget left nothing to compare it against; the configured value is kept
+    multipart_chunksize_mb: Optional[int]
+    upload_concurrency: Optional[int]
+    backup_workers: int
+    estimated_seconds: float
+
+
+def _company_files(data_path: Path) -> Dict[Path, List[Path]]:
+    companies = {}
+    for d in data_path.iterdir():
+        if d.is_dir():
+            companies[d] = [p for p in d.rglob("*") if p.is_file()]
+    return companies
+
+
+def sample_files(companies: Dict[Path, List[Path]], sample_bytes: int) -> List[Path]:
+    """Pick files round-robin across companies until ``sample_bytes`` is reached."""
+    queues = [sorted(files, key=lambda p: p.stat().st_size, reverse=True) for files in companies.values()]
+    picked: List[Path] = []
+    size = 0
+    while size < sample_bytes and any(queues):
+        for q in queues:
+            if q and size < sample_bytes:
+                fp = q.pop(0)
+                picked.append(fp)
+                size += fp.stat().st_size
+    return picked
+
+
+def measure_read(files: List[Path]) -> Tuple[bytes, float]:
+    # Note: files read recently may be served from the OS cache and look faster than disk
+    buf = io.BytesIO()
+    start = time.perf_counter()
+    for fp in files:
+        with open(fp, "rb") as f:
+            while True:
+                chunk = f.read(MB)
+                if not chunk:
+                    break
+                buf.write(chunk)
+    elapsed = time.perf_counter() - start
+    data = buf.getvalue()
+    return data, len(data) / max(elapsed, 1e-6)
+
+
+def measure_compress(data: bytes, level: int) -> Tuple[float, float, bytes]:
+    # wbits=31 produces the same gzip stream tarfile writes
+    start = time.perf_counter()
+    c = zlib.compressobj(level, zlib.DEFLATED, 31)
+    out = c.compress(data) + c.flush()
+    elapsed = time.perf_counter() - start
+    return len(data) / max(elapsed, 1e-6), len(out) / max(len(data), 1), out
+
+
+def measure_encrypt(data: bytes) -> Tuple[float, float]:
+    salt = os.urandom(16)
+    start = time.perf_counter()
+    key = derive_key_from_password(b"bench", salt)
+    kdf = time.perf_counter() - start
+    start = time.perf_counter()
+    AESGCM(key).encrypt(os.urandom(12), data, None)
+    elapsed = time.perf_counter() - start
+    return len(data) / max(elapsed, 1e-6), kdf
+
+
+# Part size used for the concurrency sweep; the smallest probed so the budget feeds the most threads
+_SWEEP_PART_MB = PART_SIZES_MB[0]
+
+
+def _probe_bytes(part_mb: int, conc: int, budget: int) -> int:
+    # Two waves of parts per thread where the budget allows, at least one
+    return min(budget, 2 * part_mb * conc * MB)
+
+
+def _feasible(part_mb: int, conc: int, budget: int) -> bool:
+    # Every thread must get at least one part, or extra concurrency measures nothing
+    return part_mb * conc * MB <= budget
+
+
+def _part_sizes(current_part_mb: Optional[int]) -> List[int]:
+    # Always compare against what the service runs with today
+    return sorted(set(PART_SIZES_MB) | ({current_part_mb} if current_part_mb else set()))
+
+
+def upload_probe_volume(budget: int, current_part_mb: Optional[int] = None) -> int:
+    """Upper bound of bytes ``measure_upload`` sends for a per-probe ``budget``."""
+    concs = [c for c in CONCURRENCIES if _feasible(_SWEEP_PART_MB, c, budget)]
+    sweep = sum(_probe_bytes(_SWEEP_PART_MB, c, budget) for c in concs)
+    parts = max(
+        (sum(_probe_bytes(p, c, budget) for p in _part_sizes(current_part_mb) if p != _SWEEP_PART_MB and _feasible(p, c, budget)) for c in concs),
+        default=0,
+    )
+    return sweep + parts
+
+
+def measure_upload(
+    bucket: str,
+    key_prefix: str,
+    budget: int,
+    region: Optional[str] = None,
+    current_part_mb: Optional[int] = None,
+) -> Dict[Tuple[int, int], float]:
+    """Coordinate search: concurrency at the smallest part size first, then part size at the best concurrency.
+
+    Each probe uploads at most ``budget`` bytes, and only combinations where every
+    thread gets at least one part are tried. ``current_part_mb`` (the configured
+    part size) is always among the part sizes compared.
+    """
+    concs = [c for c in CONCURRENCIES if _feasible(_SWEEP_PART_MB, c, budget)]
+    if not concs:
+        raise BenchError(f"Upload probe budget must be at least {2 * _SWEEP_PART_MB} MB")
+    s3 = boto3.client("s3", region_name=region)
+    # Random bytes behave like the encrypted objects we really upload
+    body = os.urandom(budget)
+    results: Dict[Tuple[int, int], float] = {}
+
+    def run(part_mb: int, conc: int) -> float:
+        size = _probe_bytes(part_mb, conc, budget)
+        cfg = make_transfer_config(part_mb * MB, conc, threshold=part_mb * MB)
+        key = f"{key_prefix}/bench_{part_mb}mb_{conc}.bin"
+        start = time.perf_counter()
+        s3.upload_fileobj(io.BytesIO(body[:size]), bucket, key, Config=cfg)
+        elapsed = time.perf_counter() - start
+        try:
+            s3.delete_object(Bucket=bucket, Key=key)
+        except Exception:
+            logger.warning("Could not delete benchmark object s3://%s/%s", bucket, key)
+        bps = size / max(elapsed, 1e-6)
+        logger.info("Upload %d MB parts x %d (%d MB): %.1f MB/s", part_mb, conc, size // MB, bps / MB)
+        return bps
+
+    for conc in concs:
+        results[(_SWEEP_PART_MB, conc)] = run(_SWEEP_PART_MB, conc)
+    best_conc = max(concs, key=lambda c: results[(_SWEEP_PART_MB, c)])
+    for part_mb in _part_sizes(current_part_mb):
+        if (part_mb, best_conc) not in results and _feasible(part_mb, best_conc, budget):
+            results[(part_mb, best_conc)] = run(part_mb, best_conc)
+    return results
+
+
+def run_bench(
+    data_path: Path,
+    bucket: str,
+    client_id: str,
+    region: Optional[str] = None,
+    sample_mb: int = 256,
+    upload_mb: int = 128,
+    current_part_mb: Optional[int] = None,
+) -> BenchResult:
+    companies = _company_files(data_path)
+    total = sum(fp.stat().st_size for files in companies.values() for fp in files)
+    files = sample_files(companies, sample_mb * MB)
+    if not files or total == 0:
+        raise BenchError(f"No company data found under {data_path}; nothing to benchmark")
+    logger.info("Benchmarking on %d files from %d companies (%d MB of %d MB)", len(files), len(companies), sample_mb, total // MB)
+
+    data, read_bps = measure_read(files)
+    logger.info("Read: %.1f MB/s", read_bps / MB)
+
+    compress_bps: Dict[int, float] = {}
+    ratios: Dict[int, float] = {}
+    compressed = data
+    for level in COMPRESSION_LEVELS:
+        compress_bps[level], ratios[level], out = measure_compress(data, level)
+        if level == 6:
+            compressed = out
+        logger.info("Compress level %d: %.1f MB/s, ratio %.2f", level, compress_bps[level] / MB, ratios[level])
+
+    encrypt_bps, kdf = measure_encrypt(compressed)
+    logger.info("Encrypt: %.1f MB/s (key derivation %.2fs per file)", encrypt_bps / MB, kdf)
+
+    upload = measure_upload(bucket, f"{client_id}/_bench", upload_mb * MB, region=region, current_part_mb=current_part_mb)
+
+    return BenchResult(
+        total_bytes=total,
+        companies=len(companies),
+        read_bps=read_bps,
+        compress_bps=compress_bps,
+        compress_ratio=ratios,
+        encrypt_bps=encrypt_bps,
+        kdf_seconds=kdf,
+        upload_bps=upload,
+    )
+
+
+def estimate_seconds(r: BenchResult, level: int, upload_bps: float, workers: int) -> float:
+    """Estimated wall time for a full backup cycle.
+
+    Each company runs read -> compress -> encrypt -> upload serially; ``workers``
+    companies run at once. Disk and uplink are shared, so the cycle can never be
+    faster than the slowest shared resource.
+    """
+    t = float(r.total_bytes)
+    out = t * r.compress_ratio[level]
+    read = t / r.read_bps
+    cpu = t / r.compress_bps[level] + out / r.encrypt_bps + r.companies * r.kdf_seconds
+    upload = out / upload_bps
+    serial = read + cpu + upload
+    workers = max(1, min(workers, r.companies))
+    return max(serial / workers, read, cpu / workers, upload)
+
+
+def choose_settings(r: BenchResult, cpu_limit: float = 0.5) -> TunedSettings:
+    """Search all measured combinations for the fastest one within the CPU budget."""
+    max_workers = max(1, int((os.cpu_count() or 1) * cpu_limit))
+    candidates: List[TunedSettings] = []
+    for level in COMPRESSION_LEVELS:
+        for (part_mb, conc), bps in r.upload_bps.items():
+            for workers in range(1, max_workers + 1):
+                candidates.append(TunedSettings(level, part_mb, conc, workers, estimate_seconds(r, level, bps, workers)))
+    best = min(c.estimated_seconds for c in candidates)
+    # Within 5% of the best, prefer smaller objects, then fewer workers
+    near = [c for c in candidates if c.estimated_seconds <= best * 1.05]
+    tuned = min(near, key=lambda c: (-c.compression_level, c.backup_workers, c.upload_concurrency, c.estimated_seconds))
+    # A value that won only because nothing else fit the probe budget is not a measurement
+    if len({p for p, c in r.upload_bps if c == tuned.upload_concurrency}) < 2:
+        logger.info("Only %d MB parts were probed at %d threads; keeping the configured part size", tuned.multipart_chunksize_mb, tuned.upload_concurrency)
+        tuned.multipart_chunksize_mb = None
+    if len({c for _, c in r.upload_bps}) < 2:
+        logger.info("Only %d upload threads were probed; keeping the configured concurrency", tuned.upload_concurrency)
+        tuned.upload_concurrency = None
+    return tuned
+
+
+def apply_settings(cfg: dict, tuned: TunedSettings, r: BenchResult) -> dict:
+    cfg = dict(cfg)
+    cfg["compression_level"] = tuned.compression_level
+    if tuned.multipart_chunksize_mb is not None:
+        cfg["multipart_chunksize_mb"] = tuned.multipart_chunksize_mb
+    if tuned.upload_concurrency is not None:
+        cfg["upload_concurrency"] = tuned.upload_concurrency
+    cfg["backup_workers"] = tuned.backup_workers
+    cfg["bench"] = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "estimated_seconds": round(tuned.estimated_seconds, 1),
+        "read_mb_per_sec": round(r.read_bps / MB, 1),
+        "encrypt_mb_per_sec": round(r.encrypt_bps / MB, 1),
+        "compress_mb_per_sec": {str(k): round(v / MB, 1) for k, v in r.compress_bps.items()},
+        "upload_mb_per_sec": {f"{p}x{c}": round(v / MB, 2) for (p, c), v in r.upload_bps.items()},
+    }
+    return cfg
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    import argparse
+
+    # Windows-only imports; bench runs on the installed machine next to the service
+    from .service_wrapper import load_config, save_config
+
+    parser = argparse.ArgumentParser(prog="agent bench", description="Benchmark this machine and tune backup settings")
+    parser.add_argument("--data-path", help="Tally Data folder (default: detected from tally.ini)")
+    parser.add_argument("--sample-mb", type=int, default=256, help="Amount of company data to sample")
+    parser.add_argument("--upload-mb", type=int, default=128, help="Maximum size of each upload probe")
+    parser.add_argument("--cpu-limit", type=float, default=0.5, help="Fraction of CPU cores backups may use")
+    parser.add_argument("--dry-run", action="store_true", help="Print chosen settings without writing config.json")
+    args = parser.parse_args(argv)
+
+    cfg = load_config()
+    if args.data_path:
+        data_path = Path(args.data_path)
+    else:
+        from .detector import locate_tally_ini
+        from .config_reader import read_tally_ini
+
+        data_path = Path(read_tally_ini(locate_tally_ini())["data_path"])
+
+    current_part_mb = int(cfg.get("multipart_chunksize_mb", 16))
+    volume = upload_probe_volume(args.upload_mb * MB, current_part_mb)
+    print(f"Upload probes will send up to {volume // MB} MB to s3://{cfg['s3_bucket']}")
+    try:
+        result = run_bench(
+            data_path, cfg["s3_bucket"], cfg["client_id"], region=cfg.get("aws_region"),
+            sample_mb=args.sample_mb, upload_mb=args.upload_mb, current_part_mb=current_part_mb,
+        )
+    except BenchError as e:
+        raise SystemExit(str(e))
+    tuned = choose_settings(result, cpu_limit=args.cpu_limit)
+    print(f"Chosen settings: {asdict(tuned)}")
+    if args.dry_run:
+        return
+    path = save_config(apply_settings(cfg, tuned, result))
+    print(f"Wrote tuned settings to {path}; restart the service to apply them")
@@ -23,8 +23,8 @@ def derive_key_from_password(password: bytes, salt: bytes, iterations: int = 200
     return kdf.derive(password)
 
 
-def encrypt_file(in_path: Path, out_path: Path, password: Optional[bytes] = None) -> None:
-    """Encrypts file using AES-256-GCM. The file format:
+def encrypt_bytes(plaintext: bytes, password: Optional[bytes] = None) -> bytes:
+    """Encrypts bytes using AES-256-GCM. Output format:
     [salt(16)][nonce(12)][ciphertext]
     Password should be provided as bytes. If not provided, raise.
     """
@@ -35,22 +35,26 @@ def encrypt_file(in_path: Path, out_path: Path, password: Optional[bytes] = None
     key = derive_key_from_password(password, salt)
     aesgcm = AESGCM(key)
     nonce = os.urandom(12)
+    return salt + nonce + aesgcm.encrypt(nonce, plaintext, None)
+
+
+def decrypt_bytes(data: bytes, password: bytes) -> bytes:
+    salt = data[:16]
+    nonce = data[16:28]
+    ct = data[28:]
+    key = derive_key_from_password(password, salt)
+    aesgcm = AESGCM(key)
+    return aesgcm.decrypt(nonce, ct, None)
 
+
+def encrypt_file(in_path: Path, out_path: Path, password: Optional[bytes] = None) -> None:
+    """Encrypts file using AES-256-GCM in the ``encrypt_bytes`` format."""
     with open(in_path, "rb") as f:
         plaintext = f.read()
 
-    ct = aesgcm.encrypt(nonce, plaintext, None)
-
     with open(out_path, "wb") as f:
-        f.write(salt + nonce + ct)
+        f.write(encrypt_bytes(plaintext, password))
 
 
 def decrypt_file(enc_path: Path, out_path: Path, password: bytes) -> None:
-    data = enc_path.read_bytes()
-    salt = data[:16]
-    nonce = data[16:28]
-    ct = data[28:]
-    key = derive_key_from_password(password, salt)
-    aesgcm = AESGCM(key)
-    pt = aesgcm.decrypt(nonce, ct, None)
-    out_path.write_bytes(pt)
+    out_path.write_bytes(decrypt_bytes(enc_path.read_bytes(), password))
@@ -0,0 +1,308 @@
+"""Resource governor that keeps backups from slowing down interactive Tally users.
+
+The governor lowers the CPU and I/O priority of the agent process while a
+backup runs, rate-limits disk reads and upload bandwidth with token buckets,
+and backs off when the machine is busy (high CPU or a long disk queue).
+Limits come from a schedule so sites can run at full speed after hours and
+throttled during business hours.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional
+
+import psutil
+
+from .logging_config import setup_logging
+
+logger = setup_logging()
+
+_DAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+
+class TokenBucket:
+    """Thread-safe token bucket. ``rate`` is bytes per second; ``None`` means unlimited."""
+
+    def __init__(self, rate: Optional[float], burst: Optional[float] = None):
+        self._lock = threading.Lock()
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate: Optional[float], burst: Optional[float] = None) -> None:
+        with self._lock:
+            self.rate = rate
+            # Default burst of one second worth of tokens keeps large reads smooth
+            self.capacity = burst if burst is not None else (rate or 0.0)
+            self._tokens = min(self._tokens, self.capacity)
+
+    def consume(self, amount: float) -> None:
+        """Block until ``amount`` tokens are available."""
+        while True:
+            with self._lock:
+                if not self.rate:
+                    return
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                # Requests larger than the bucket are allowed to drive the balance negative
+                if self._tokens > 0 or amount <= 0:
+                    self._tokens -= amount
+                    return
+                wait = -self._tokens / self.rate
+            time.sleep(min(wait, 1.0))
+
+
+@dataclass
+class ScheduleWindow:
+    """Limits that apply on ``days`` between ``start`` and ``end`` (HH:MM, local time)."""
+
+    days: List[str] = field(default_factory=lambda: list(_DAYS))
+    start: str = "00:00"
+    end: str = "24:00"
+    low_priority: bool = True
+    read_bytes_per_sec: Optional[float] = None
+    upload_bytes_per_sec: Optional[float] = None
+    adaptive: bool = True
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "ScheduleWindow":
+        mb = 1024 * 1024
+        read = d.get("read_mb_per_sec")
+        upload = d.get("upload_mb_per_sec")
+        return cls(
+            days=[x.lower()[:3] for x in d.get("days", _DAYS)],
+            start=d.get("start", "00:00"),
+            end=d.get("end", "24:00"),
+            low_priority=bool(d.get("low_priority", True)),
+            read_bytes_per_sec=float(read) * mb if read else None,
+            upload_bytes_per_sec=float(upload) * mb if upload else None,
+            adaptive=bool(d.get("adaptive", True)),
+        )
+
+    def matches(self, t: time.struct_time) -> bool:
+        minute = t.tm_hour * 60 + t.tm_min
+        start, end = _to_minutes(self.start), _to_minutes(self.end)
+        if start <= end:
+            return _DAYS[t.tm_wday] in self.days and start <= minute < end
+        # Window crosses midnight (e.g. 20:00-06:00); ``days`` name the day it starts on
+        if minute >= start:
+            return _DAYS[t.tm_wday] in self.days
+        return minute < end and _DAYS[(t.tm_wday - 1) % 7] in self.days
+
+
+def _to_minutes(hhmm: str) -> int:
+    h, m = hhmm.split(":", 1)
+    return int(h) * 60 + int(m)
+
+
+# Used when no schedule window matches: full speed, normal priority
+FULL_SPEED = ScheduleWindow(low_priority=False, adaptive=False)
+
+
+class ResourceGovernor:
+    def __init__(
+        self,
+        schedule: Optional[List[ScheduleWindow]] = None,
+        cpu_threshold: float = 70.0,
+        disk_queue_threshold: float = 2.0,
+        max_backoff_seconds: float = 30.0,
+    ):
+        self.schedule = schedule or []
+        self.cpu_threshold = cpu_threshold
+        self.disk_queue_threshold = disk_queue_threshold
+        self.max_backoff_seconds = max_backoff_seconds
+        self.read_bucket = TokenBucket(None)
+        self.upload_bucket = TokenBucket(None)
+        self._window = FULL_SPEED
+        self._sessions = 0
+        self._lock = threading.Lock()
+        self._saved_priority = None
+        self._load_lock = threading.Lock()
+        self._last_load_check = 0.0
+        self._busy = False
+        self._disk_sample = self._disk_busy_ms()
+        self._last_refresh = 0.0
+        self._proc = psutil.Process()
+
+    @classmethod
+    def from_config(cls, cfg: Optional[dict]) -> Optional["ResourceGovernor"]:
+        """Build a governor from the ``governor`` section of config.json (``None`` disables it)."""
+        if not cfg:
+            return None
+        windows = [ScheduleWindow.from_dict(w) for w in cfg.get("schedule", [])]
+        if not windows:
+            # No schedule: throttle all the time using the top-level limits
+            windows = [ScheduleWindow.from_dict(cfg)]
+        return cls(
+            schedule=windows,
+            cpu_threshold=float(cfg.get("cpu_threshold", 70.0)),
+            disk_queue_threshold=float(cfg.get("disk_queue_threshold", 2.0)),
+            max_backoff_seconds=float(cfg.get("max_backoff_seconds", 30.0)),
+        )
+
+    def current_window(self) -> ScheduleWindow:
+        now = time.localtime()
+        for w in self.schedule:
+            if w.matches(now):
+                return w
+        return FULL_SPEED
+
+    def refresh(self) -> None:
+        """Apply the limits of the schedule window that is active now."""
+        self._last_refresh = time.monotonic()
+        w = self.current_window()
+        if w is not self._window:
+            logger.info(
+                "Governor window changed: low_priority=%s read=%s B/s upload=%s B/s",
+                w.low_priority, w.read_bytes_per_sec, w.upload_bytes_per_sec,
+            )
+        self._window = w
+        self.read_bucket.set_rate(w.read_bytes_per_sec)
+        self.upload_bucket.set_rate(w.upload_bytes_per_sec)
+        with self._lock:
+            if self._sessions:
+                self._apply_priority(w.low_priority)
+
+    @contextmanager
+    def backup_session(self) -> Iterator["ResourceGovernor"]:
+        """Run the enclosed backup work under the governor's priority and limits."""
+        with self._lock:
+            self._sessions += 1
+        self.refresh()
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._sessions -= 1
+                if not self._sessions:
+                    self._apply_priority(False)
+
+    def _apply_priority(self, low: bool) -> None:
+        proc = psutil.Process()
+        try:
+            if low:
+                if self._saved_priority is None:
+                    self._saved_priority = (proc.nice(), _get_ionice(proc))
+                if psutil.WINDOWS:
+                    proc.nice(psutil.IDLE_PRIORITY_CLASS)
+                    proc.ionice(psutil.IOPRIO_VERYLOW)
+                else:
+                    proc.nice(19)
+                    if hasattr(proc, "ionice"):
+                        proc.ionice(psutil.IOPRIO_CLASS_IDLE)
+            elif self._saved_priority is not None:
+                nice, ionice = self._saved_priority
+                self._saved_priority = None
+                proc.nice(nice)
+                if isinstance(ionice, tuple):
+                    proc.ionice(*ionice)
+                elif ionice is not None:
+                    proc.ionice(ionice)
+        except (psutil.AccessDenied, OSError) as e:
+            # Unprivileged processes cannot raise priority back on POSIX; not fatal
+            logger.debug("Could not change process priority: %s", e)
+
+    def throttle_read(self, nbytes: int) -> None:
+        self._maybe_refresh()
+        self.read_bucket.consume(nbytes)
+        self.wait_if_busy()
+
+    def throttle_upload(self, nbytes: int) -> None:
+        """Throttle before sending ``nbytes``; only call between requests, never mid-request."""
+        self._maybe_refresh()
+        self.upload_bucket.consume(nbytes)
+        self.wait_if_busy()
+
+    def _maybe_refresh(self) -> None:
+        # Long backups can straddle a schedule boundary (e.g. business hours ending)
+        if time.monotonic() - self._last_refresh > 60:
+            self.refresh()
+
+    def upload_callback(self, nbytes: int) -> None:
+        """boto3 transfer ``Callback``; sleeping here throttles the uploading thread.
+
+        Runs while a part request is in flight, so only the token bucket applies:
+        an adaptive back-off here could idle the socket past S3's request timeout.
+        """
+        self._maybe_refresh()
+        self.upload_bucket.consume(nbytes)
+
+    def wait_if_busy(self) -> None:
+        """Back off with growing delays while system CPU or disk queue is above threshold.
+
+        The total wait per call is capped at ``max_backoff_seconds`` so a busy
+        machine slows backups down without stalling them indefinitely.
+        """
+        if not self._window.adaptive:
+            return
+        deadline = time.monotonic() + self.max_backoff_seconds
+        delay = 0.5
+        while self._system_busy():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(delay, remaining))
+            delay *= 2
+
+    def _system_busy(self) -> bool:
+        with self._load_lock:
+            now = time.monotonic()
+            # Sample at most twice a second; callers on hot read paths reuse the last answer
+            if now - self._last_load_check < 0.5:
+                return self._busy
+            elapsed = now - self._last_load_check
+            self._last_load_check = now
+            # Exclude the agent's own compress/encrypt load so the governor does not throttle itself
+            own = self._proc.cpu_percent(interval=None) / (psutil.cpu_count() or 1)
+            cpu = max(0.0, psutil.cpu_percent(interval=None) - own)
+            busy_ms = self._disk_busy_ms()
+            queue = 0.0
+            if busy_ms is not None and self._disk_sample is not None and elapsed < 60:
+                # Little's law: accumulated I/O time per wall-clock time ~ average queue length
+                queue = (busy_ms - self._disk_sample) / (elapsed * 1000.0)
+            self._disk_sample = busy_ms
+            busy = cpu > self.cpu_threshold or queue > self.disk_queue_threshold
+            if busy and not self._busy:
+                logger.info("System busy (cpu=%.0f%%, disk queue=%.1f); backing off", cpu, queue)
+            self._busy = busy
+            return busy
+
+    @staticmethod
+    def _disk_busy_ms() -> Optional[float]:
+        try:
+            io = psutil.disk_io_counters()
+        except Exception:
+            return None
+        if io is None:
+            return None
+        return float(io.read_time + io.write_time)
+
+
+def _get_ionice(proc: psutil.Process):
+    try:
+        val = proc.ionice()
+    except (AttributeError, psutil.AccessDenied, OSError):
+        return None
+    # POSIX returns a (class, value) named tuple, Windows a plain int
+    return tuple(val) if isinstance(val, tuple) else val
+
+
+class ThrottledReader:
+    """File-like wrapper that charges every read against the governor's read bucket."""
+
+    def __init__(self, fileobj, governor: ResourceGovernor):
+        self._f = fileobj
+        self._governor = governor
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._f.read(size)
+        if data:
+            self._governor.throttle_read(len(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
@@ -0,0 +1,109 @@
+"""Crash-safe per-company job journal.
+
+Records a company's progress through the backup pipeline (copy, compress,
+encrypt, upload) together with content fingerprints, so a backup interrupted
+by a service stop or reboot resumes from the last completed stage instead of
+starting over. Progress is only reused while the source fingerprint is
+unchanged; artifacts are re-verified against their recorded SHA-256 first.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from .logging_config import setup_logging
+
+logger = setup_logging()
+
+STAGES = ("copy", "compress", "encrypt", "upload")
+
+
+def sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _atomic_write(path: Path, text: str) -> None:
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class JobJournal:
+    def __init__(self, journal_dir: Path, company: str):
+        self.journal_dir = Path(journal_dir)
+        self.company = company
+        self.path = self.journal_dir / f"{company}.json"
+        self.state: dict = {}
+
+    @staticmethod
+    def pending(journal_dir: Path) -> List[str]:
+        """Companies with a journal that did not reach the end of the pipeline."""
+        journal_dir = Path(journal_dir)
+        if not journal_dir.exists():
+            return []
+        return sorted(p.stem for p in journal_dir.glob("*.json"))
+
+    def begin(self, fingerprint: str) -> bool:
+        """Load the journal for ``fingerprint``; returns True when resuming earlier progress."""
+        self.journal_dir.mkdir(parents=True, exist_ok=True)
+        if self.path.exists():
+            try:
+                state = json.loads(self.path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                logger.warning("Discarding unreadable journal %s", self.path)
+                state = {}
+            if state.get("fingerprint") == fingerprint:
+                self.state = state
+                done = [s for s in STAGES if s in state.get("stages", {})]
+                logger.info("Resuming backup of %s after stages %s", self.company, done)
+                return True
+            if state:
+                logger.info("Source of %s changed since interrupted backup; starting over", self.company)
+        self.state = {"company": self.company, "fingerprint": fingerprint, "started": time.time(), "stages": {}}
+        self._write()
+        return False
+
+    def completed(self, stage: str) -> Optional[dict]:
+        """Recorded info for ``stage`` if it completed and its artifact is still intact."""
+        info = self.state.get("stages", {}).get(stage)
+        if info is None:
+            return None
+        artifact = info.get("path")
+        if artifact and "sha256" in info:
+            p = Path(artifact)
+            if not p.exists() or sha256_file(p) != info["sha256"]:
+                logger.warning("Artifact for stage %s of %s is missing or changed; redoing", stage, self.company)
+                self._drop_from(stage)
+                return None
+        return info
+
+    def record(self, stage: str, **info) -> None:
+        self.state.setdefault("stages", {})[stage] = info
+        self._write()
+
+    def finish(self) -> None:
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _drop_from(self, stage: str) -> None:
+        # Later stages were built from this artifact, so they are invalid too
+        stages = self.state.get("stages", {})
+        for s in STAGES[STAGES.index(stage):]:
+            stages.pop(s, None)
+        self._write()
+
+    def _write(self) -> None:
+        _atomic_write(self.path, json.dumps(self.state, indent=2))
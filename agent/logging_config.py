@@ -1,6 +1,125 @@
+"""Logging for the agent.
+
+Records are handed to a bounded in-memory queue and written by a background
+listener thread, so callers (including watchdog callback threads) never block
+on disk or console I/O. The log file holds one JSON object per line; every
+record carries the correlation ID of the backup it belongs to (see
+``backup_context``). High-frequency events should go through ``EventSampler``
+which aggregates them into periodic summaries instead of one record each.
+"""
+import atexit
+import contextvars
+import copy
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+import queue
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
+from typing import Iterator
+
+_context: contextvars.ContextVar[dict] = contextvars.ContextVar("tally_agent_log_context", default={})
+
+QUEUE_SIZE = 10_000
+# How long a WARNING or worse may wait for room in a full queue
+PRIORITY_PUT_TIMEOUT = 5.0
+
+
+@contextmanager
+def backup_context(**fields) -> Iterator[str]:
+    """Tag every record logged in this block (same thread) with a fresh correlation ID and ``fields``."""
+    cid = uuid.uuid4().hex[:12]
+    token = _context.set({"correlation_id": cid, **fields})
+    try:
+        yield cid
+    finally:
+        _context.reset(token)
+
+
+class _ContextFilter(logging.Filter):
+    # Runs in the caller's thread, where the context variable is visible
+    def filter(self, record: logging.LogRecord) -> bool:
+        ctx = _context.get()
+        record.correlation_id = ctx.get("correlation_id", "-")
+        record.context = {k: v for k, v in ctx.items() if k != "correlation_id"}
+        return True
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """Drops DEBUG/INFO records instead of blocking when the writer falls behind.
+
+    WARNING and worse wait (briefly) for room instead. The number of dropped
+    records is logged as a WARNING as soon as the queue accepts records again.
+    """
+
+    def __init__(self, q: queue.Queue):
+        super().__init__(q)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Render message and traceback now (args may be mutated later), but keep
+        # the traceback separate so the JSON formatter can put it in its own field
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            if record.levelno >= logging.WARNING:
+                self.queue.put(record, timeout=PRIORITY_PUT_TIMEOUT)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+            return
+        self._report_dropped(record)
+
+    def _report_dropped(self, after: logging.LogRecord) -> None:
+        with self._dropped_lock:
+            count, self.dropped = self.dropped, 0
+        if not count:
+            return
+        notice = logging.makeLogRecord({
+            "name": after.name, "levelno": logging.WARNING, "levelname": "WARNING",
+            "msg": f"Log queue full: dropped {count} records", "args": None,
+            "correlation_id": "-", "context": {}, "fields": {"dropped_records": count},
+        })
+        notice.message = notice.msg
+        try:
+            self.queue.put_nowait(notice)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += count
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        doc = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "correlation_id": getattr(record, "correlation_id", "-"),
+            "msg": record.getMessage(),
+        }
+        doc.update(getattr(record, "context", {}) or {})
+        fields = getattr(record, "fields", None)
+        if fields:
+            doc.update(fields)
+        if record.exc_text:
+            doc["exc"] = record.exc_text
+        return json.dumps(doc, default=str)
 
 
 def setup_logging(log_dir: str | Path = None, level: int = logging.INFO) -> logging.Logger:
@@ -16,12 +135,58 @@ def setup_logging(log_dir: str | Path = None, level: int = logging.INFO) -> logg
 
     if not logger.handlers:
         fh = RotatingFileHandler(str(log_file), maxBytes=10 * 1024 * 1024, backupCount=10, encoding="utf-8")
-        fmt = logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s")
-        fh.setFormatter(fmt)
-        logger.addHandler(fh)
+        fh.setFormatter(JsonFormatter())
 
         sh = logging.StreamHandler()
-        sh.setFormatter(fmt)
-        logger.addHandler(sh)
+        sh.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] [%(correlation_id)s] %(message)s"))
+
+        q: queue.Queue = queue.Queue(maxsize=QUEUE_SIZE)
+        qh = _NonBlockingQueueHandler(q)
+        qh.addFilter(_ContextFilter())
+        logger.addHandler(qh)
+        logger.propagate = False
+
+        listener = QueueListener(q, fh, sh, respect_handler_level=True)
+        listener.start()
+        # Flush whatever is still queued when the process exits
+        atexit.register(listener.stop)
 
     return logger
+
+
+class EventSampler:
+    """Aggregate high-frequency events into one summary record per ``interval`` seconds.
+
+    ``record`` only increments a counter; a summary such as
+    ``Filesystem events: 512 (modified=500, created=12) in 30.0s`` is logged when
+    the interval has elapsed or on ``flush``.
+    """
+
+    def __init__(self, logger: logging.Logger, label: str, interval: float = 30.0, level: int = logging.DEBUG):
+        self.logger = logger
+        self.label = label
+        self.interval = interval
+        self.level = level
+        self._counts: Counter = Counter()
+        self._lock = threading.Lock()
+        self._since = time.monotonic()
+
+    def record(self, kind: str) -> None:
+        with self._lock:
+            self._counts[kind] += 1
+            due = time.monotonic() - self._since >= self.interval
+        if due:
+            self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            elapsed = time.monotonic() - self._since
+            self._since = time.monotonic()
+        if not counts or not self.logger.isEnabledFor(self.level):
+            return
+        detail = ", ".join(f"{k}={v}" for k, v in counts.most_common())
+        self.logger.log(
+            self.level, "%s: %d (%s) in %.1fs", self.label, sum(counts.values()), detail, elapsed,
+            extra={"fields": {"event_counts": dict(counts)}},
+        )
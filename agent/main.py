@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import os
+import sys
 from pathlib import Path
 
 from .service import run_console
@@ -10,6 +11,12 @@ def main():
     # CLI entry used by service or during development
     import argparse
 
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        from .bench import main as bench_main
+
+        bench_main(sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(description="TallyPrime Backup Agent")
     parser.add_argument("--bucket", required=True, help="S3 bucket name")
     parser.add_argument("--client-id", required=True, help="Client identifier")
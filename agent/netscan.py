@@ -0,0 +1,271 @@
+"""Network-share (UNC/SMB) mode: polling change detection and parallel reads.
+
+On SMB shares recursive change notifications are unreliable and every
+per-file ``stat`` is a network round trip. This module instead:
+
+- walks trees with ``os.scandir``, whose entries carry size/mtime from the
+  directory listing itself (one round trip per directory on Windows);
+- detects changes by comparing against a snapshot of that metadata which is
+  persisted between runs, so changes made while the agent was down are seen;
+- polls at an adaptive interval: fast while data is changing, backing off
+  while the share is idle;
+- copies with several large sequential reads in flight to hide latency.
+"""
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from .logging_config import setup_logging
+from .governor import ResourceGovernor
+from .watcher import tally_running
+
+logger = setup_logging()
+
+BLOCK_SIZE = 8 * 1024 * 1024
+
+Snapshot = Dict[str, Tuple[int, float]]
+
+
+def scan_tree(root: Path) -> Snapshot:
+    """Map of relative path -> (size, mtime) for every file under ``root``."""
+    out: Snapshot = {}
+    stack = [("", str(root))]
+    while stack:
+        rel_dir, abs_dir = stack.pop()
+        with os.scandir(abs_dir) as it:
+            for entry in it:
+                rel = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((rel, entry.path))
+                elif entry.is_file(follow_symlinks=False):
+                    st = entry.stat(follow_symlinks=False)
+                    out[rel] = (st.st_size, st.st_mtime)
+    return out
+
+
+def _copy_file(src: str, dst: str, block_size: int, governor: Optional[ResourceGovernor]) -> None:
+    buf = bytearray(block_size)
+    view = memoryview(buf)
+    with open(src, "rb", buffering=0) as fsrc, open(dst, "wb") as fdst:
+        while True:
+            n = fsrc.readinto(buf)
+            if not n:
+                break
+            if governor:
+                governor.throttle_read(n)
+            fdst.write(view[:n])
+    shutil.copystat(src, dst)
+
+
+def parallel_copytree(
+    src: Path,
+    dst: Path,
+    workers: int = 4,
+    block_size: int = BLOCK_SIZE,
+    governor: Optional[ResourceGovernor] = None,
+) -> Path:
+    """Copy ``src`` to ``dst`` with ``workers`` files read concurrently in large blocks."""
+    files = scan_tree(src)
+    dst.mkdir(parents=True, exist_ok=True)
+    for rel in files:
+        (dst / rel).parent.mkdir(parents=True, exist_ok=True)
+    # Largest first so a big file does not start last and dominate the tail
+    order = sorted(files, key=lambda r: files[r][0], reverse=True)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="netcopy") as pool:
+        futures = [pool.submit(_copy_file, str(src / rel), str(dst / rel), block_size, governor) for rel in order]
+        for f in futures:
+            f.result()
+    return dst
+
+
+class PollingWatcher:
+    """Drop-in replacement for ``Watcher`` on network shares.
+
+    A company is backed up once it has changed and then stayed unchanged for
+    ``debounce_seconds``, or at once when a local Tally process exits (Tally
+    running on another machine against the share is not seen). Like
+    ``Watcher``'s monitor this fires on the exit itself, not on every check
+    while Tally is down.
+
+    ``backup_callback`` returns whether the backup succeeded and
+    ``scan_complete_callback`` the names of companies whose deferred backup
+    failed. Only successful companies advance the snapshot; failed ones stay
+    pending and are retried after another ``debounce_seconds``.
+    """
+
+    def __init__(
+        self,
+        data_path: Path,
+        backup_callback: Callable[[Path], bool],
+        debounce_seconds: int = 120,
+        max_workers: int = 1,
+        scan_complete_callback: Optional[Callable[[], Optional[Iterable[str]]]] = None,
+        state_file: Optional[Path] = None,
+        min_interval: float = 15.0,
+        max_interval: float = 300.0,
+    ):
+        self.data_path = data_path
+        self.backup_callback = backup_callback
+        self.debounce_seconds = debounce_seconds
+        self.max_workers = max(1, max_workers)
+        self.scan_complete_callback = scan_complete_callback
+        self.state_file = state_file
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self._stop = threading.Event()
+        # Set to cut a poll wait short; _flush_now makes every pending company due
+        self._wake = threading.Event()
+        self._flush_now = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._monitor_thread: Optional[threading.Thread] = None
+
+    def _load_state(self) -> Dict[str, Snapshot]:
+        if self.state_file is None or not self.state_file.exists():
+            return {}
+        try:
+            raw = json.loads(self.state_file.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            logger.warning("Ignoring unreadable scan snapshot %s", self.state_file)
+            return {}
+        return {c: {rel: tuple(v) for rel, v in files.items()} for c, files in raw.items()}
+
+    def _save_state(self, state: Dict[str, Snapshot]) -> None:
+        if self.state_file is None:
+            return
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.state_file.with_suffix(self.state_file.suffix + ".tmp")
+        tmp.write_text(json.dumps(state), encoding="utf-8")
+        os.replace(tmp, self.state_file)
+
+    def _scan(self) -> Dict[str, Snapshot]:
+        out = {}
+        with os.scandir(self.data_path) as it:
+            for entry in it:
+                if entry.is_dir():
+                    try:
+                        out[entry.name] = scan_tree(Path(entry.path))
+                    except OSError as e:
+                        logger.warning("Could not scan %s: %s", entry.path, e)
+        return out
+
+    def start(self):
+        self._thread = threading.Thread(target=self._poll_loop, daemon=True)
+        self._thread.start()
+        self._monitor_thread = threading.Thread(target=self._process_monitor_loop, daemon=True)
+        self._monitor_thread.start()
+        logger.info("Started polling watcher on network share %s", self.data_path)
+
+    def _process_monitor_loop(self):
+        was_running = tally_running()
+        while not self._stop.wait(5):
+            running = tally_running()
+            if was_running and not running:
+                logger.info("Tally process exited; backing up pending changes now")
+                self._flush_now.set()
+                self._wake.set()
+            was_running = running
+
+    def _poll_loop(self):
+        backed_up = self._load_state()
+        previous: Dict[str, Snapshot] = {}
+        # company -> monotonic time of the last change we saw
+        dirty: Dict[str, float] = {}
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                current = self._scan()
+            except OSError as e:
+                logger.warning("Network share scan failed: %s", e)
+                self._sleep(self.max_interval)
+                continue
+            scan_seconds = time.monotonic() - started
+
+            # Deleted companies: stop retrying them and forget their snapshot. A
+            # company that merely failed to scan still has its folder and is kept
+            gone = [c for c in set(dirty) | set(backed_up) if c not in current and not (self.data_path / c).is_dir()]
+            if gone:
+                logger.info("Companies removed from share: %s", ", ".join(sorted(gone)))
+                for c in gone:
+                    dirty.pop(c, None)
+                    backed_up.pop(c, None)
+                self._save_state(backed_up)
+
+            now = time.monotonic()
+            changed = [c for c, snap in current.items() if snap != previous.get(c)]
+            for c in changed:
+                if current[c] != backed_up.get(c):
+                    dirty[c] = now
+            previous = current
+
+            flush_now = self._flush_now.is_set()
+            self._flush_now.clear()
+            due = [c for c, t in dirty.items() if flush_now or now - t >= self.debounce_seconds]
+            if due:
+                failed = self._run_backups(sorted(due), current, backed_up)
+                for c in due:
+                    if c in failed:
+                        dirty[c] = time.monotonic()
+                    else:
+                        dirty.pop(c, None)
+
+            # Adapt: poll fast while things change, back off while idle, and never
+            # spend more than ~10% of the time scanning a slow share
+            if changed or dirty:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.interval * 1.5, self.max_interval)
+            wait = max(self.interval, scan_seconds * 10)
+            if dirty:
+                wait = min(wait, max(self.debounce_seconds, self.min_interval))
+            logger.debug("Scanned %d companies in %.1fs; next poll in %.0fs", len(current), scan_seconds, wait)
+            self._sleep(wait)
+
+    def _sleep(self, seconds: float) -> None:
+        self._wake.wait(seconds)
+        self._wake.clear()
+
+    def _backup(self, company_dir: Path) -> bool:
+        try:
+            return bool(self.backup_callback(company_dir))
+        except Exception as e:
+            logger.exception("Backup of %s raised: %s", company_dir, e)
+            return False
+
+    def _run_backups(self, companies: List[str], current: Dict[str, Snapshot], backed_up: Dict[str, Snapshot]) -> Set[str]:
+        """Back up ``companies``; returns those that failed, which keep their old snapshot."""
+        logger.info("Changes settled on network share; backing up %s", ", ".join(companies))
+        dirs = [self.data_path / c for c in companies]
+        if self.max_workers == 1:
+            results = [self._backup(d) for d in dirs]
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="backup") as pool:
+                results = list(pool.map(self._backup, dirs))
+        failed = {c for c, ok in zip(companies, results) if not ok}
+        if self.scan_complete_callback:
+            try:
+                failed.update(self.scan_complete_callback() or ())
+            except Exception as e:
+                logger.exception("Scan-complete callback raised: %s", e)
+                failed.update(companies)
+        for c in companies:
+            if c not in failed:
+                backed_up[c] = current[c]
+        self._save_state(backed_up)
+        if failed:
+            logger.warning("Backup failed for %s; will retry", ", ".join(sorted(failed)))
+        return failed
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        logger.info("Watcher stopped")
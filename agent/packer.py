@@ -0,0 +1,177 @@
+"""Pack many small companies into one encrypted object.
+
+Sites with hundreds of small or dormant companies would otherwise upload
+hundreds of tiny ``.enc`` objects per cycle, each with its own PBKDF2 run and
+PUT. A pack holds one compressed archive per company, all encrypted with a
+single key derived once per pack, followed by an encrypted index of member
+offsets and a fixed-size trailer:
+
+    [member]...[member][index][trailer]
+    member  = [nonce(12)][AES-GCM(company .tar.gz, aad=company name)]
+    index   = [nonce(12)][AES-GCM(json {company: {offset, length}}, aad=b"index")]
+    trailer = [magic(8)][salt(16)][index offset(8)][index length(8)]
+
+A single company is restored with three range reads: trailer, index, member.
+"""
+from __future__ import annotations
+
+import json
+import os
+import struct
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from .logging_config import setup_logging
+from .encryption import derive_key_from_password
+from .backup_engine import safe_copy_company, compress_directory
+from .governor import ResourceGovernor
+from .netscan import scan_tree
+
+logger = setup_logging()
+
+MAGIC = b"TBPACK01"
+TRAILER = struct.Struct(">8s16sQQ")
+PACK_SUFFIX = ".pack"
+_INDEX_AAD = b"index"
+
+
+class PackError(Exception):
+    pass
+
+
+def directory_size(path: Path) -> int:
+    return sum(size for size, _ in scan_tree(path).values())
+
+
+class PackWriter:
+    def __init__(self, out_path: Path, password: bytes):
+        self.out_path = out_path
+        self.salt = os.urandom(16)
+        self._aesgcm = AESGCM(derive_key_from_password(password, self.salt))
+        self._f = open(out_path, "wb")
+        self.index: Dict[str, dict] = {}
+        self.size = 0
+
+    def add(self, company: str, data: bytes) -> None:
+        nonce = os.urandom(12)
+        blob = nonce + self._aesgcm.encrypt(nonce, data, company.encode())
+        self._f.write(blob)
+        self.index[company] = {"offset": self.size, "length": len(blob), "created": time.time()}
+        self.size += len(blob)
+
+    def close(self) -> Path:
+        nonce = os.urandom(12)
+        index = nonce + self._aesgcm.encrypt(nonce, json.dumps(self.index).encode(), _INDEX_AAD)
+        self._f.write(index)
+        self._f.write(TRAILER.pack(MAGIC, self.salt, self.size, len(index)))
+        self._f.close()
+        return self.out_path
+
+
+def build_packs(
+    companies: List[Path],
+    password: bytes,
+    out_dir: Path,
+    max_pack_bytes: int,
+    compression_level: int = 9,
+    governor: Optional[ResourceGovernor] = None,
+    network_share: bool = False,
+) -> List[PackWriter]:
+    """Compress each company and append it to a pack, starting a new pack at ``max_pack_bytes``."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    # Seconds plus a random tag: packs from two flushes never share a key, even within one second
+    stamp = f"{time.strftime('%Y-%m-%d_%H-%M-%S')}_{uuid.uuid4().hex[:8]}"
+    packs: List[PackWriter] = []
+    writer: Optional[PackWriter] = None
+    try:
+        for company_dir in companies:
+            with tempfile.TemporaryDirectory() as td:
+                td_path = Path(td)
+                copied = safe_copy_company(company_dir, td_path, governor=governor, network_share=network_share)
+                archive = td_path / f"{company_dir.name}.tar.gz"
+                compress_directory(copied, archive, governor=governor, compression_level=compression_level)
+                data = archive.read_bytes()
+            if writer is not None and writer.size + len(data) > max_pack_bytes:
+                writer.close()
+                writer = None
+            if writer is None:
+                writer = PackWriter(out_dir / f"pack_{stamp}_{len(packs) + 1:03d}{PACK_SUFFIX}", password)
+                packs.append(writer)
+            writer.add(company_dir.name, data)
+        if writer is not None:
+            writer.close()
+    except Exception:
+        for w in packs:
+            w._f.close()
+            w.out_path.unlink(missing_ok=True)
+        raise
+    for w in packs:
+        logger.info("Built pack %s with %d companies (%d bytes)", w.out_path, len(w.index), w.size)
+    return packs
+
+
+def _ranged_get(s3, bucket: str, key: str, range_header: str) -> bytes:
+    return s3.get_object(Bucket=bucket, Key=key, Range=range_header)["Body"].read()
+
+
+def read_pack_index(s3, bucket: str, key: str, password: bytes) -> tuple:
+    """Return ``(aesgcm, index)`` for a pack using two range reads."""
+    trailer = _ranged_get(s3, bucket, key, f"bytes=-{TRAILER.size}")
+    magic, salt, offset, length = TRAILER.unpack(trailer)
+    if magic != MAGIC:
+        raise PackError(f"Not a backup pack: s3://{bucket}/{key}")
+    aesgcm = AESGCM(derive_key_from_password(password, salt))
+    raw = _ranged_get(s3, bucket, key, f"bytes={offset}-{offset + length - 1}")
+    index = json.loads(aesgcm.decrypt(raw[:12], raw[12:], _INDEX_AAD))
+    return aesgcm, index
+
+
+def find_company_packs(
+    s3,
+    bucket: str,
+    client_id: str,
+    company: str,
+    password: bytes,
+    limit: Optional[int] = None,
+    known_keys: Optional[Iterable[str]] = None,
+) -> List[str]:
+    """Keys of the packs under ``client_id/packs/`` that contain ``company``, newest first.
+
+    ``known_keys`` are the company's pack keys from the local upload index
+    (``UploadIndex.keys_for(company, "pack")``); when there are any they are
+    returned as is. Otherwise packed companies have no objects under their own
+    prefix, so this reads each pack's index (two range reads and one key
+    derivation per pack) until ``limit`` matches are found.
+    """
+    if known_keys:
+        found = sorted(set(known_keys), reverse=True)
+        return found[:limit] if limit is not None else found
+    keys = []
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=f"{client_id}/packs/"):
+        keys.extend(obj["Key"] for obj in page.get("Contents", []) if obj["Key"].endswith(PACK_SUFFIX))
+    found: List[str] = []
+    # Keys are .../YYYY/MM/pack_<YYYY-MM-DD_HH-MM-SS>_<tag>_<n>.pack, so they sort by time
+    for key in sorted(keys, reverse=True):
+        _, index = read_pack_index(s3, bucket, key, password)
+        if company in index:
+            found.append(key)
+            if limit is not None and len(found) >= limit:
+                break
+    return found
+
+
+def restore_company_from_pack(s3, bucket: str, key: str, company: str, password: bytes, out_path: Path) -> Path:
+    """Write the ``.tar.gz`` of ``company`` from a pack to ``out_path``."""
+    aesgcm, index = read_pack_index(s3, bucket, key, password)
+    if company not in index:
+        raise PackError(f"Company {company} not in pack {key}")
+    entry = index[company]
+    raw = _ranged_get(s3, bucket, key, f"bytes={entry['offset']}-{entry['offset'] + entry['length'] - 1}")
+    out_path.write_bytes(aesgcm.decrypt(raw[:12], raw[12:], company.encode()))
+    logger.info("Restored %s from pack %s to %s", company, key, out_path)
+    return out_path
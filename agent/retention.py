@@ -0,0 +1,251 @@
+"""Grandfather-father-son retention for uploaded backups.
+
+Every upload is appended to a local index (JSON lines), so deciding what to
+expire never needs a bucket listing. Per company and backup kind the policy
+keeps the newest backup of each hour for ``hourly_hours``, of each day for
+``daily_days`` and of each month for ``monthly_months``; the newest backup of
+a series is always kept. Expired keys are removed with ``DeleteObjects`` in
+batches of 1000, and kept backups in older tiers can be moved to a cheaper
+storage class.
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .logging_config import setup_logging
+from .packer import PACK_SUFFIX, read_pack_index
+
+logger = setup_logging()
+
+DELETE_BATCH = 1000
+TIERS = ("hourly", "daily", "monthly")
+
+
+class UploadIndex:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        # Written after a complete seed_from_bucket; the index may exist long before that
+        self.seeded_marker = self.path.with_suffix(".seeded")
+        self._lock = threading.Lock()
+
+    @property
+    def seeded(self) -> bool:
+        return self.seeded_marker.exists()
+
+    def add(self, key: str, company: str, kind: str, companions: Optional[List[str]] = None, uploaded: Optional[float] = None) -> None:
+        entry = {
+            "key": key,
+            "company": company,
+            "kind": kind,
+            "time": uploaded if uploaded is not None else time.time(),
+            "storage_class": "STANDARD",
+            "companions": companions or [],
+        }
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def entries(self) -> List[dict]:
+        with self._lock:
+            return self._read()
+
+    def _read(self) -> List[dict]:
+        if not self.path.exists():
+            return []
+        out = []
+        for line in self.path.read_text(encoding="utf-8").splitlines():
+            try:
+                out.append(json.loads(line))
+            except ValueError:
+                # A torn last line from a crash mid-append
+                continue
+        return out
+
+    def keys_for(self, company: str, kind: Optional[str] = None) -> List[str]:
+        """Indexed keys of ``company`` (optionally of one ``kind``), newest first."""
+        entries = [e for e in self.entries() if e["company"] == company and (kind is None or e["kind"] == kind)]
+        return [e["key"] for e in sorted(entries, key=lambda e: e["time"], reverse=True)]
+
+    def update(self, deleted: set, storage_classes: Dict[str, str]) -> None:
+        """Drop deleted keys and record new storage classes; re-reads under the lock so concurrent adds survive."""
+        with self._lock:
+            entries = self._read()
+            tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                for e in entries:
+                    if e["key"] in deleted:
+                        continue
+                    if e["key"] in storage_classes:
+                        e["storage_class"] = storage_classes[e["key"]]
+                    f.write(json.dumps(e) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+
+    def seed_from_bucket(self, s3, bucket: str, client_id: str, password: Optional[bytes] = None) -> int:
+        """Listing to index backups uploaded before the index existed.
+
+        Keys already indexed are skipped, so this is safe to repeat; it writes
+        ``seeded_marker`` only after a full listing in which every pack could be
+        read, and is meant to run until that marker exists. Pack keys
+        (``client/packs/...``) carry no company in their path; their members are
+        read from the pack index, which needs ``password``. Without it packs are
+        left out of the index and so never expired.
+        """
+        known = {e["key"] for e in self.entries()}
+        added = 0
+        complete = True
+        for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=f"{client_id}/"):
+            for obj in page.get("Contents", []):
+                key = obj["Key"]
+                parts = key.split("/")
+                if key in known or len(parts) != 5 or key.endswith(".syn.manifest"):
+                    continue
+                uploaded = obj["LastModified"].timestamp()
+                if key.endswith(PACK_SUFFIX):
+                    if password is None:
+                        logger.warning("Not indexing pack %s: its members need the encryption password", key)
+                        continue
+                    try:
+                        _, members = read_pack_index(s3, bucket, key, password)
+                    except Exception as e:
+                        logger.warning("Not indexing pack %s: %s", key, e)
+                        complete = False
+                        continue
+                    for company in members:
+                        self.add(key, company, "pack", uploaded=uploaded)
+                    added += 1
+                    continue
+                kind = "synthetic" if key.endswith(".syn") else "backup"
+                companions = [key + ".manifest"] if kind == "synthetic" else []
+                self.add(key, parts[1], kind, companions=companions, uploaded=uploaded)
+                added += 1
+        if complete:
+            self.seeded_marker.parent.mkdir(parents=True, exist_ok=True)
+            self.seeded_marker.write_text(time.strftime("%Y-%m-%dT%H:%M:%S"), encoding="utf-8")
+        logger.info("Seeded upload index with %d existing objects%s", added, "" if complete else " (incomplete; will retry)")
+        return added
+
+
+@dataclass
+class RetentionPolicy:
+    hourly_hours: int = 24
+    daily_days: int = 31
+    monthly_months: int = 12
+    # Tier name -> S3 storage class for backups kept in that tier, e.g. {"monthly": "GLACIER_IR"}
+    transitions: Dict[str, str] = field(default_factory=dict)
+
+    @classmethod
+    def from_config(cls, cfg: Optional[dict]) -> Optional["RetentionPolicy"]:
+        if not cfg:
+            return None
+        return cls(
+            hourly_hours=int(cfg.get("hourly_hours", 24)),
+            daily_days=int(cfg.get("daily_days", 31)),
+            monthly_months=int(cfg.get("monthly_months", 12)),
+            transitions=dict(cfg.get("transitions", {})),
+        )
+
+    def tier(self, age_seconds: float) -> Optional[str]:
+        if age_seconds <= self.hourly_hours * 3600:
+            return "hourly"
+        if age_seconds <= self.daily_days * 86400:
+            return "daily"
+        if age_seconds <= self.monthly_months * 31 * 86400:
+            return "monthly"
+        return None
+
+
+@dataclass
+class RetentionPlan:
+    keep: Dict[str, str]
+    delete: List[str]
+    transitions: Dict[str, str]
+
+
+def _bucket_of(tier: str, t: float) -> str:
+    fmt = {"hourly": "%Y%m%d%H", "daily": "%Y%m%d", "monthly": "%Y%m"}[tier]
+    return time.strftime(fmt, time.localtime(t))
+
+
+def plan_retention(entries: List[dict], policy: RetentionPolicy, now: Optional[float] = None) -> RetentionPlan:
+    now = now if now is not None else time.time()
+    series: Dict[Tuple[str, str], List[dict]] = {}
+    for e in entries:
+        series.setdefault((e["company"], e["kind"]), []).append(e)
+
+    keep: Dict[str, str] = {}
+    # The newest synthetic full is the UploadPartCopy source of the next one, and
+    # copies cannot read archive storage classes; it stays where it is
+    pinned = set()
+    for (_, kind), items in series.items():
+        items.sort(key=lambda e: e["time"], reverse=True)
+        if kind == "synthetic":
+            pinned.add(items[0]["key"])
+        seen = set()
+        for i, e in enumerate(items):
+            tier = policy.tier(now - e["time"])
+            if i == 0:
+                tier = tier or "monthly"
+            elif tier is None:
+                continue
+            slot = (tier, _bucket_of(tier, e["time"]))
+            if slot in seen:
+                continue
+            seen.add(slot)
+            # Pack keys are shared by several companies; the youngest tier wins
+            if e["key"] not in keep or TIERS.index(tier) < TIERS.index(keep[e["key"]]):
+                keep[e["key"]] = tier
+
+    # dict keeps insertion order and de-duplicates shared pack keys
+    delete: Dict[str, None] = {}
+    transitions: Dict[str, str] = {}
+    for e in entries:
+        key = e["key"]
+        if key not in keep:
+            delete[key] = None
+            delete.update(dict.fromkeys(e.get("companions", [])))
+            continue
+        target = policy.transitions.get(keep[key])
+        if target and key not in pinned and e.get("storage_class", "STANDARD") != target:
+            transitions[key] = target
+    return RetentionPlan(keep, list(delete), transitions)
+
+
+def delete_keys(s3, bucket: str, keys: List[str]) -> List[str]:
+    """Delete in batches of 1000; returns the keys that were actually deleted."""
+    deleted: List[str] = []
+    for i in range(0, len(keys), DELETE_BATCH):
+        batch = keys[i: i + DELETE_BATCH]
+        resp = s3.delete_objects(Bucket=bucket, Delete={"Objects": [{"Key": k} for k in batch], "Quiet": True})
+        failed = {err["Key"] for err in resp.get("Errors", [])}
+        for err in resp.get("Errors", []):
+            logger.warning("Could not delete s3://%s/%s: %s", bucket, err["Key"], err.get("Message"))
+        deleted.extend(k for k in batch if k not in failed)
+    return deleted
+
+
+def apply_retention(s3, bucket: str, index: UploadIndex, policy: RetentionPolicy, now: Optional[float] = None) -> RetentionPlan:
+    entries = index.entries()
+    plan = plan_retention(entries, policy, now=now)
+    deleted = set(delete_keys(s3, bucket, plan.delete)) if plan.delete else set()
+
+    moved = {}
+    for key, storage_class in plan.transitions.items():
+        try:
+            # Managed copy onto itself; switches to multipart copy above 5 GB
+            s3.copy({"Bucket": bucket, "Key": key}, bucket, key, ExtraArgs={"StorageClass": storage_class, "MetadataDirective": "COPY"})
+            moved[key] = storage_class
+        except Exception as e:
+            logger.warning("Storage class transition of %s to %s failed: %s", key, storage_class, e)
+
+    index.update(deleted, moved)
+    logger.info("Retention: kept %d objects, deleted %d, transitioned %d", len(plan.keep), len(deleted), len(moved))
+    return plan
@@ -1,46 +1,238 @@
 from __future__ import annotations
 
+import json
 import threading
 import time
 import sys
+from contextlib import nullcontext
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Set
 
-from .logging_config import setup_logging
+from .logging_config import setup_logging, backup_context
 from .detector import locate_tally_ini, find_tally_install_path
 from .config_reader import read_tally_ini
-from .validator import validate_data_dir
+from .validator import validate_data_dir, is_network_path
 from .watcher import Watcher
+from .netscan import PollingWatcher
 from .backup_engine import create_encrypted_backup
-from .uploader import upload_file_multipart
+from .uploader import upload_file_multipart, s3_client, DEFAULT_CHUNKSIZE, DEFAULT_CONCURRENCY
+from .governor import ResourceGovernor
+from .journal import JobJournal
+from .packer import build_packs, directory_size
+from .retention import UploadIndex, RetentionPolicy, apply_retention
+from .synthetic import create_synthetic_full, find_latest_manifest, SYN_SUFFIX
 
 logger = setup_logging()
 
 
 class AgentService:
-    def __init__(self, s3_bucket: str, client_id: str, encryption_password: bytes, debounce_seconds: int = 120, region: Optional[str] = None):
+    def __init__(
+        self,
+        s3_bucket: str,
+        client_id: str,
+        encryption_password: bytes,
+        debounce_seconds: int = 120,
+        region: Optional[str] = None,
+        governor: Optional[ResourceGovernor] = None,
+        compression_level: int = 9,
+        multipart_chunksize: int = DEFAULT_CHUNKSIZE,
+        upload_concurrency: int = DEFAULT_CONCURRENCY,
+        backup_workers: int = 1,
+        synthetic_full_days: int = 0,
+        s3_endpoint_url: Optional[str] = None,
+        pack_threshold_bytes: int = 0,
+        pack_max_bytes: int = 256 * 1024 * 1024,
+        retention: Optional[RetentionPolicy] = None,
+        network_share: Optional[bool] = None,
+        poll_min_seconds: float = 15.0,
+        poll_max_seconds: float = 300.0,
+    ):
         self.s3_bucket = s3_bucket
         self.client_id = client_id
         self.encryption_password = encryption_password
         self.debounce_seconds = debounce_seconds
         self.region = region
-        self._watcher: Optional[Watcher] = None
+        self.governor = governor
+        self.compression_level = compression_level
+        self.multipart_chunksize = multipart_chunksize
+        self.upload_concurrency = upload_concurrency
+        self.backup_workers = backup_workers
+        self.synthetic_full_days = synthetic_full_days
+        self.s3_endpoint_url = s3_endpoint_url
+        self.pack_threshold_bytes = pack_threshold_bytes
+        self.pack_max_bytes = pack_max_bytes
+        self._pack_queue: list = []
+        self._pack_lock = threading.Lock()
+        # Local backup dir; also holds the agent's per-client state files
+        self.local_dir = Path.home() / "tally_backups" / client_id
+        self.journal_dir = self.local_dir / "journal"
+        self.retention = retention
+        # None: decide from the data path at startup
+        self.network_share = network_share
+        self.poll_min_seconds = poll_min_seconds
+        self.poll_max_seconds = poll_max_seconds
+        self.upload_index = UploadIndex(self.local_dir / "upload_index.jsonl")
+        self._company_locks: dict = {}
+        self._locks_guard = threading.Lock()
+        self._watcher = None
         self._running = False
 
-    def _backup_and_upload(self, company_dir: Path):
+    def _session(self):
+        return self.governor.backup_session() if self.governor else nullcontext()
+
+    @staticmethod
+    def _month_prefix() -> str:
+        return time.strftime("%Y/%m", time.gmtime())
+
+    def _company_lock(self, name: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._company_locks.setdefault(name, threading.Lock())
+
+    def _backup_and_upload(self, company_dir: Path) -> bool:
+        """Returns False if the backup failed; a packed company's result comes from ``_flush_packs``."""
+        # Small companies are collected during the scan and uploaded together in _flush_packs
+        if self.pack_threshold_bytes and directory_size(company_dir) < self.pack_threshold_bytes:
+            with self._pack_lock:
+                self._pack_queue.append(company_dir)
+            return True
+        return self._backup_single(company_dir)
+
+    def _backup_single(self, company_dir: Path) -> bool:
+        # A resumed job and a watcher scan must not share one journal and work dir
+        with self._company_lock(company_dir.name), self._session(), backup_context(company=company_dir.name, job="backup"):
+            return self._run_backup(company_dir)
+
+    def _run_backup(self, company_dir: Path) -> bool:
         try:
-            # Local temp backup dir
-            dest = Path.home() / "tally_backups" / self.client_id
-            enc = create_encrypted_backup(company_dir, self.encryption_password, dest)
-
-            # Build S3 key: client-id/company-name/YYYY/MM/
-            ts = time.gmtime()
-            y = time.strftime("%Y", ts)
-            m = time.strftime("%m", ts)
-            key = f"{self.client_id}/{company_dir.name}/{y}/{m}/{enc.name}"
-            upload_file_multipart(enc, self.s3_bucket, key, region=self.region)
+            dest = self.local_dir
+            journal = JobJournal(self.journal_dir, company_dir.name)
+            enc = create_encrypted_backup(
+                company_dir, self.encryption_password, dest, governor=self.governor,
+                compression_level=self.compression_level, journal=journal,
+                network_share=bool(self.network_share),
+            )
+
+            if journal.completed("upload") is None:
+                # Build S3 key: client-id/company-name/YYYY/MM/
+                key = f"{self.client_id}/{company_dir.name}/{self._month_prefix()}/{enc.name}"
+                upload_file_multipart(
+                    enc, self.s3_bucket, key, region=self.region, governor=self.governor,
+                    chunksize=self.multipart_chunksize, max_concurrency=self.upload_concurrency,
+                    endpoint_url=self.s3_endpoint_url,
+                )
+                # Index first: a crash in between re-uploads rather than leaving an unindexed object
+                self.upload_index.add(key, company_dir.name, "backup")
+                journal.record("upload", key=key)
+            journal.finish()
+            return True
         except Exception as e:
             logger.exception("Failed backup/upload for %s: %s", company_dir, e)
+            return False
+
+    def _resume_pending(self, data_path: Path):
+        for name in JobJournal.pending(self.journal_dir):
+            company_dir = data_path / name
+            if not self._running:
+                return
+            if not company_dir.is_dir():
+                logger.warning("Dropping journal for missing company %s", name)
+                JobJournal(self.journal_dir, name).finish()
+                continue
+            logger.info("Resuming interrupted backup for %s", name)
+            self._backup_single(company_dir)
+
+    def _flush_packs(self) -> Set[str]:
+        """Pack and upload the queued small companies; returns the names of those not uploaded."""
+        with self._pack_lock:
+            companies, self._pack_queue = self._pack_queue, []
+        if not companies:
+            return set()
+        uploaded: Set[str] = set()
+        try:
+            with self._session(), backup_context(job="pack", companies=len(companies)):
+                packs = build_packs(
+                    sorted(companies, key=lambda p: p.name), self.encryption_password, self.local_dir / "packs",
+                    self.pack_max_bytes, compression_level=self.compression_level, governor=self.governor,
+                    network_share=bool(self.network_share),
+                )
+                try:
+                    for pack in packs:
+                        key = f"{self.client_id}/packs/{self._month_prefix()}/{pack.out_path.name}"
+                        upload_file_multipart(
+                            pack.out_path, self.s3_bucket, key, region=self.region, governor=self.governor,
+                            chunksize=self.multipart_chunksize, max_concurrency=self.upload_concurrency,
+                            endpoint_url=self.s3_endpoint_url,
+                        )
+                        for company in pack.index:
+                            self.upload_index.add(key, company, "pack")
+                        uploaded.update(pack.index)
+                finally:
+                    # Packs are rebuilt from source next time; never leave them on disk
+                    for pack in packs:
+                        pack.out_path.unlink(missing_ok=True)
+        except Exception as e:
+            logger.exception("Failed to pack/upload %d small companies: %s", len(companies), e)
+        return {c.name for c in companies} - uploaded
+
+    def _synthetic_state_file(self) -> Path:
+        return self.local_dir / "synthetic_state.json"
+
+    def _synthetic_full(self, company_dir: Path, state: dict) -> None:
+        s3 = s3_client(self.region, self.s3_endpoint_url)
+        company = company_dir.name
+        prev = state.get(company, {}).get("manifest_key")
+        if prev is None:
+            prev = find_latest_manifest(s3, self.s3_bucket, f"{self.client_id}/{company}/")
+        name = f"full_{time.strftime('%Y-%m-%d_%H-%M')}_{company}{SYN_SUFFIX}"
+        key = f"{self.client_id}/{company}/{self._month_prefix()}/{name}"
+        with self._session(), backup_context(company=company, job="synthetic_full"):
+            result = create_synthetic_full(
+                s3, self.s3_bucket, key, company_dir, self.encryption_password,
+                previous_manifest_key=prev, part_size=self.multipart_chunksize, governor=self.governor,
+            )
+        self.upload_index.add(result.key, company, "synthetic", companions=[result.manifest_key])
+        state[company] = {"time": time.time(), "manifest_key": result.manifest_key}
+
+    def _synthetic_loop(self, companies: list):
+        # Consolidate each company into a fresh synthetic full every ``synthetic_full_days``
+        sf = self._synthetic_state_file()
+        while self._running:
+            state = json.loads(sf.read_text(encoding="utf-8")) if sf.exists() else {}
+            due = time.time() - self.synthetic_full_days * 86400
+            for company_dir in companies:
+                if not self._running:
+                    break
+                if state.get(company_dir.name, {}).get("time", 0) > due:
+                    continue
+                try:
+                    self._synthetic_full(company_dir, state)
+                    sf.parent.mkdir(parents=True, exist_ok=True)
+                    sf.write_text(json.dumps(state, indent=2), encoding="utf-8")
+                except Exception as e:
+                    logger.exception("Synthetic full failed for %s: %s", company_dir, e)
+            for _ in range(3600):
+                if not self._running:
+                    return
+                time.sleep(1)
+
+    def _retention_loop(self):
+        s3 = s3_client(self.region, self.s3_endpoint_url)
+        while self._running:
+            # The index also fills while retention is off; seed until one full listing succeeded
+            if not self.upload_index.seeded:
+                try:
+                    self.upload_index.seed_from_bucket(s3, self.s3_bucket, self.client_id, password=self.encryption_password)
+                except Exception as e:
+                    logger.exception("Could not seed upload index: %s", e)
+            try:
+                with backup_context(job="retention"):
+                    apply_retention(s3, self.s3_bucket, self.upload_index, self.retention)
+            except Exception as e:
+                logger.exception("Retention run failed: %s", e)
+            for _ in range(3600):
+                if not self._running:
+                    return
+                time.sleep(1)
 
     def start(self):
         self._running = True
@@ -54,8 +246,27 @@ class AgentService:
             logger.exception("Startup validation failed: %s", e)
             raise
 
-        self._watcher = Watcher(data_path, backup_callback=self._backup_and_upload, debounce_seconds=self.debounce_seconds)
+        if self.network_share is None:
+            self.network_share = is_network_path(data_path)
+        if self.network_share:
+            # Change notifications are unreliable on SMB; poll a persisted metadata snapshot instead
+            self._watcher = PollingWatcher(
+                data_path, backup_callback=self._backup_and_upload, debounce_seconds=self.debounce_seconds,
+                max_workers=self.backup_workers, scan_complete_callback=self._flush_packs,
+                state_file=self.local_dir / "scan_snapshot.json",
+                min_interval=self.poll_min_seconds, max_interval=self.poll_max_seconds,
+            )
+        else:
+            self._watcher = Watcher(
+                data_path, backup_callback=self._backup_and_upload, debounce_seconds=self.debounce_seconds,
+                max_workers=self.backup_workers, scan_complete_callback=self._flush_packs,
+            )
         self._watcher.start()
+        threading.Thread(target=self._resume_pending, args=(data_path,), daemon=True).start()
+        if self.synthetic_full_days:
+            threading.Thread(target=self._synthetic_loop, args=(companies,), daemon=True).start()
+        if self.retention:
+            threading.Thread(target=self._retention_loop, daemon=True).start()
         logger.info("Agent service started")
         try:
             while self._running:
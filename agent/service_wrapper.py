@@ -27,11 +27,15 @@ except Exception:  # pragma: no cover - windows only
 try:
     # Preferred: relative imports when used as a package (python -m agent.service_wrapper)
     from .service import AgentService
+    from .governor import ResourceGovernor
+    from .retention import RetentionPolicy
     from .logging_config import setup_logging
 except Exception:
     # Fallback: allow running the script directly (python agent/service_wrapper.py)
     try:
         from agent.service import AgentService
+        from agent.governor import ResourceGovernor
+        from agent.retention import RetentionPolicy
         from agent.logging_config import setup_logging
     except Exception:
         raise
@@ -39,14 +43,51 @@ except Exception:
 logger = setup_logging()
 
 
-def load_config() -> dict:
+def config_path() -> Path:
     pd = Path(os.environ.get("PROGRAMDATA", r"C:\\ProgramData")) / "TallyBackupAgent"
-    cfgf = pd / "config.json"
+    return pd / "config.json"
+
+
+def load_config() -> dict:
+    cfgf = config_path()
     if not cfgf.exists():
         raise FileNotFoundError(f"Config not found: {cfgf}")
     return json.loads(cfgf.read_text(encoding="utf-8"))
 
 
+def save_config(cfg: dict) -> Path:
+    """Atomically write config.json so a running service never reads a partial file."""
+    cfgf = config_path()
+    cfgf.parent.mkdir(parents=True, exist_ok=True)
+    tmp = cfgf.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(cfg, indent=2), encoding="utf-8")
+    os.replace(tmp, cfgf)
+    return cfgf
+
+
+def build_agent(cfg: dict) -> AgentService:
+    return AgentService(
+        s3_bucket=cfg.get("s3_bucket"),
+        client_id=cfg.get("client_id"),
+        encryption_password=cfg.get("encryption_password", "").encode(),
+        debounce_seconds=int(cfg.get("debounce_seconds", 120)),
+        region=cfg.get("aws_region"),
+        governor=ResourceGovernor.from_config(cfg.get("governor")),
+        compression_level=int(cfg.get("compression_level", 9)),
+        multipart_chunksize=int(cfg.get("multipart_chunksize_mb", 16)) * 1024 * 1024,
+        upload_concurrency=int(cfg.get("upload_concurrency", 10)),
+        backup_workers=int(cfg.get("backup_workers", 1)),
+        synthetic_full_days=int(cfg.get("synthetic_full_days", 0)),
+        s3_endpoint_url=cfg.get("s3_endpoint_url"),
+        pack_threshold_bytes=int(float(cfg.get("pack_threshold_mb", 0)) * 1024 * 1024),
+        pack_max_bytes=int(float(cfg.get("pack_max_mb", 256)) * 1024 * 1024),
+        retention=RetentionPolicy.from_config(cfg.get("retention")),
+        network_share=cfg.get("network_share"),
+        poll_min_seconds=float(cfg.get("poll_min_seconds", 15)),
+        poll_max_seconds=float(cfg.get("poll_max_seconds", 300)),
+    )
+
+
 class TallyBackupWindowsService(win32serviceutil.ServiceFramework):
     _svc_name_ = "TallyBackupAgent"
     _svc_display_name_ = "TallyPrime Backup Agent"
@@ -71,13 +112,7 @@ class TallyBackupWindowsService(win32serviceutil.ServiceFramework):
             servicemanager.LogErrorMsg(f"Failed to load config: {e}")
             return
 
-        password = cfg.get("encryption_password", "").encode()
-        s3_bucket = cfg.get("s3_bucket")
-        client_id = cfg.get("client_id")
-        debounce = int(cfg.get("debounce_seconds", 120))
-        region = cfg.get("aws_region")
-
-        self.agent = AgentService(s3_bucket=s3_bucket, client_id=client_id, encryption_password=password, debounce_seconds=debounce, region=region)
+        self.agent = build_agent(cfg)
 
         def run_agent():
             try:
@@ -102,13 +137,7 @@ if __name__ == "__main__":
             print(f"Failed to load config: {e}")
             sys.exit(1)
 
-        password = cfg.get("encryption_password", "").encode()
-        s3_bucket = cfg.get("s3_bucket")
-        client_id = cfg.get("client_id")
-        debounce = int(cfg.get("debounce_seconds", 120))
-        region = cfg.get("aws_region")
-
-        svc = AgentService(s3_bucket=s3_bucket, client_id=client_id, encryption_password=password, debounce_seconds=debounce, region=region)
+        svc = build_agent(cfg)
         try:
             svc.start()
         except KeyboardInterrupt:
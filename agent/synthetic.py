@@ -0,0 +1,337 @@
+"""Server-side synthetic full backups.
+
+A synthetic full is a ``.syn`` object made of independently encrypted 8 MiB
+frames (one or more per company file) plus an encrypted ``.syn.manifest``
+object that records, for every file, its size/mtime fingerprint and, for every
+frame, its byte range and the SHA-256 of its plaintext. A new full is assembled
+with a multipart upload: frames whose content is unchanged are copied from the
+previous full on the storage side with ``UploadPartCopy``, and only changed
+frames are uploaded. Changed files are first copied to a private work dir so a
+frame's content always matches the size/mtime recorded for its file.
+
+Frame format: [nonce(12)][ciphertext]. Frames are encrypted with a key derived
+from the password and a per-object salt; copied frames keep the salt of the
+object they were first written to, so the manifest lists every salt in use.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from botocore.exceptions import ClientError
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from .logging_config import setup_logging
+from .encryption import derive_key_from_password, encrypt_bytes, decrypt_bytes
+from .governor import ResourceGovernor
+from .netscan import scan_tree
+from .backup_engine import copy_file
+
+logger = setup_logging()
+
+MB = 1024 * 1024
+FRAME_SIZE = 8 * MB
+# S3 limits: every part except the last must be >= 5 MiB; copied parts <= 5 GiB
+MIN_PART = 5 * MB
+MAX_COPY_PART = 5 * 1024 * MB
+# Restore reads adjacent frames in ranges of at most this size, so memory stays bounded
+RESTORE_READ_BYTES = 64 * MB
+SYN_SUFFIX = ".syn"
+MANIFEST_SUFFIX = ".syn.manifest"
+
+
+class SyntheticError(Exception):
+    pass
+
+
+@dataclass
+class SyntheticResult:
+    key: str
+    manifest_key: str
+    copied_bytes: int
+    uploaded_bytes: int
+
+
+def _frame_aad(path: str, index: int) -> bytes:
+    return f"{path}:{index}".encode()
+
+
+def _ranged_get(s3, bucket: str, key: str, start: int, end: int) -> bytes:
+    """Read bytes [start, end) of an object."""
+    resp = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end - 1}")
+    return resp["Body"].read()
+
+
+class _PartWriter:
+    """Feeds copy ranges and new data into one multipart upload, honouring S3 part size limits.
+
+    Contiguous copy ranges are coalesced. A copy run too small to be its own part,
+    or needed to top up a pending data buffer to ``MIN_PART``, is fetched with a
+    ranged GET and uploaded as data instead.
+    """
+
+    def __init__(self, s3, bucket: str, key: str, part_size: int = 16 * MB, governor: Optional[ResourceGovernor] = None):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, MIN_PART)
+        self.governor = governor
+        self.upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key)["UploadId"]
+        self.parts: List[dict] = []
+        self.offset = 0
+        self.copied_bytes = 0
+        self.uploaded_bytes = 0
+        self._buf = bytearray()
+        self._run: Optional[Tuple[str, int, int]] = None
+
+    def add_data(self, data: bytes) -> int:
+        """Append data; returns the offset it will have in the final object."""
+        self._flush_run()
+        at = self.offset
+        self._buf += data
+        self.offset += len(data)
+        while len(self._buf) >= self.part_size:
+            self._upload(bytes(self._buf[: self.part_size]))
+            del self._buf[: self.part_size]
+        return at
+
+    def add_copy(self, src_key: str, start: int, length: int) -> int:
+        """Append ``length`` bytes of ``src_key`` starting at ``start``; returns the new offset."""
+        at = self.offset
+        self.offset += length
+        if self._run and self._run[0] == src_key and self._run[2] == start:
+            self._run = (src_key, self._run[1], start + length)
+        else:
+            self._flush_run()
+            self._run = (src_key, start, start + length)
+        return at
+
+    def _flush_run(self) -> None:
+        if self._run is None:
+            return
+        src, start, end = self._run
+        self._run = None
+        if self._buf and len(self._buf) < MIN_PART:
+            take = min(MIN_PART - len(self._buf), end - start)
+            self._buf += _ranged_get(self.s3, self.bucket, src, start, start + take)
+            start += take
+        if start == end:
+            return
+        if self._buf:
+            self._upload(bytes(self._buf))
+            self._buf.clear()
+        length = end - start
+        if length < MIN_PART:
+            self._buf += _ranged_get(self.s3, self.bucket, src, start, end)
+            return
+        # Split evenly so every piece stays within [MIN_PART, MAX_COPY_PART]
+        pieces = -(-length // MAX_COPY_PART)
+        size = -(-length // pieces)
+        while start < end:
+            stop = min(start + size, end)
+            self._copy(src, start, stop)
+            start = stop
+
+    def _upload(self, data: bytes) -> None:
+        if self.governor:
+            self.governor.throttle_upload(len(data))
+        n = len(self.parts) + 1
+        resp = self.s3.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=n, Body=data)
+        self.parts.append({"PartNumber": n, "ETag": resp["ETag"]})
+        self.uploaded_bytes += len(data)
+
+    def _copy(self, src: str, start: int, end: int) -> None:
+        n = len(self.parts) + 1
+        resp = self.s3.upload_part_copy(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=n,
+            CopySource={"Bucket": self.bucket, "Key": src},
+            CopySourceRange=f"bytes={start}-{end - 1}",
+        )
+        self.parts.append({"PartNumber": n, "ETag": resp["CopyPartResult"]["ETag"]})
+        self.copied_bytes += end - start
+
+    def complete(self) -> None:
+        self._flush_run()
+        if self._buf or not self.parts:
+            self._upload(bytes(self._buf))
+            self._buf.clear()
+        self.s3.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={"Parts": self.parts}
+        )
+
+    def abort(self) -> None:
+        try:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        except ClientError:
+            logger.warning("Could not abort multipart upload %s for %s", self.upload_id, self.key)
+
+
+def load_manifest(s3, bucket: str, manifest_key: str, password: bytes) -> dict:
+    blob = s3.get_object(Bucket=bucket, Key=manifest_key)["Body"].read()
+    return json.loads(decrypt_bytes(blob, password))
+
+
+def find_latest_manifest(s3, bucket: str, prefix: str) -> Optional[str]:
+    """Latest manifest under ``prefix``; keys embed YYYY/MM and a timestamp so they sort by time."""
+    latest = None
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            if obj["Key"].endswith(MANIFEST_SUFFIX) and (latest is None or obj["Key"] > latest):
+                latest = obj["Key"]
+    return latest
+
+
+def _scan_files(company_dir: Path) -> List[Tuple[str, Path, int, float]]:
+    out = []
+    for rel, (size, mtime) in scan_tree(company_dir).items():
+        out.append((rel.replace(os.sep, "/"), company_dir / rel, size, mtime))
+    return sorted(out)
+
+
+def create_synthetic_full(
+    s3,
+    bucket: str,
+    key: str,
+    company_dir: Path,
+    password: bytes,
+    previous_manifest_key: Optional[str] = None,
+    part_size: int = 16 * MB,
+    governor: Optional[ResourceGovernor] = None,
+) -> SyntheticResult:
+    """Assemble a new full at ``key`` from the previous full plus changed files."""
+    prev: Optional[dict] = None
+    prev_key = None
+    if previous_manifest_key:
+        try:
+            prev = load_manifest(s3, bucket, previous_manifest_key, password)
+            prev_key = previous_manifest_key[: -len(MANIFEST_SUFFIX)] + SYN_SUFFIX
+        except ClientError as e:
+            logger.warning("Previous manifest %s unavailable (%s); uploading a fresh full", previous_manifest_key, e)
+    prev_files = {f["path"]: f for f in prev["files"]} if prev else {}
+    prev_salts = prev["salts"] if prev else []
+
+    salt = os.urandom(16)
+    aesgcm = AESGCM(derive_key_from_password(password, salt))
+    salts: List[str] = []
+    salt_index: Dict[str, int] = {}
+
+    def use_salt(hex_salt: str) -> int:
+        if hex_salt not in salt_index:
+            salt_index[hex_salt] = len(salts)
+            salts.append(hex_salt)
+        return salt_index[hex_salt]
+
+    def copy_frame(fr: dict) -> dict:
+        at = writer.add_copy(prev_key, fr["offset"], fr["length"])
+        return {"offset": at, "length": fr["length"], "salt": use_salt(prev_salts[fr["salt"]]), "sha256": fr.get("sha256")}
+
+    def add_changed_file(rel: str, snapshot: Path, old: Optional[dict]) -> List[dict]:
+        old_frames = old["frames"] if old else []
+        frames = []
+        with open(snapshot, "rb") as f:
+            index = 0
+            while True:
+                chunk = f.read(FRAME_SIZE)
+                # An empty file still gets one (empty) frame
+                if not chunk and index:
+                    break
+                digest = hashlib.sha256(chunk).hexdigest()
+                if index < len(old_frames) and old_frames[index].get("sha256") == digest:
+                    # Same position, same content: the old frame's AAD (path:index) still holds
+                    frames.append(copy_frame(old_frames[index]))
+                else:
+                    nonce = os.urandom(12)
+                    frame = nonce + aesgcm.encrypt(nonce, chunk, _frame_aad(rel, index))
+                    at = writer.add_data(frame)
+                    frames.append({"offset": at, "length": len(frame), "salt": use_salt(salt.hex()), "sha256": digest})
+                index += 1
+                if len(chunk) < FRAME_SIZE:
+                    break
+        return frames
+
+    files = []
+    writer = _PartWriter(s3, bucket, key, part_size=part_size, governor=governor)
+    try:
+        with tempfile.TemporaryDirectory() as td:
+            for rel, fp, size, mtime in _scan_files(company_dir):
+                old = prev_files.get(rel)
+                if old and old["size"] == size and old["mtime"] == mtime:
+                    frames = [copy_frame(fr) for fr in old["frames"]]
+                else:
+                    # Tally may be writing this file; frame a private copy so the
+                    # recorded size/mtime describe exactly the bytes we upload
+                    snapshot = copy_file(fp, Path(td) / "snapshot", governor=governor)
+                    st = snapshot.stat()
+                    size, mtime = st.st_size, st.st_mtime
+                    frames = add_changed_file(rel, snapshot, old)
+                    snapshot.unlink()
+                files.append({"path": rel, "size": size, "mtime": mtime, "frames": frames})
+        writer.complete()
+    except Exception:
+        writer.abort()
+        raise
+
+    manifest = {
+        "version": 2,
+        "company": company_dir.name,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "base": previous_manifest_key,
+        "salts": salts,
+        "files": files,
+    }
+    manifest_key = key[: -len(SYN_SUFFIX)] + MANIFEST_SUFFIX
+    # Written last: a .syn without a manifest is never picked up as a base
+    s3.put_object(Bucket=bucket, Key=manifest_key, Body=encrypt_bytes(json.dumps(manifest).encode(), password))
+    logger.info(
+        "Synthetic full %s: %d bytes copied server-side, %d bytes uploaded",
+        key, writer.copied_bytes, writer.uploaded_bytes,
+    )
+    return SyntheticResult(key, manifest_key, writer.copied_bytes, writer.uploaded_bytes)
+
+
+def _read_groups(frames: List[dict], limit: int) -> Iterator[List[Tuple[int, dict]]]:
+    """Split ``(index, frame)`` pairs into runs of adjacent frames of at most ``limit`` bytes (one frame at least)."""
+    group: List[Tuple[int, dict]] = []
+    for i, fr in enumerate(frames):
+        if group:
+            first, last = group[0][1], group[-1][1]
+            adjacent = last["offset"] + last["length"] == fr["offset"]
+            if not adjacent or fr["offset"] + fr["length"] - first["offset"] > limit:
+                yield group
+                group = []
+        group.append((i, fr))
+    if group:
+        yield group
+
+
+def restore_synthetic(s3, bucket: str, manifest_key: str, password: bytes, out_dir: Path) -> Path:
+    """Restore a synthetic full into ``out_dir/<company>``."""
+    manifest = load_manifest(s3, bucket, manifest_key, password)
+    key = manifest_key[: -len(MANIFEST_SUFFIX)] + SYN_SUFFIX
+    ciphers = [AESGCM(derive_key_from_password(password, bytes.fromhex(s))) for s in manifest["salts"]]
+    root = out_dir / manifest["company"]
+    for entry in manifest["files"]:
+        target = root / entry["path"]
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with open(target, "wb") as f:
+            for group in _read_groups(entry["frames"], RESTORE_READ_BYTES):
+                start = group[0][1]["offset"]
+                blob = _ranged_get(s3, bucket, key, start, group[-1][1]["offset"] + group[-1][1]["length"])
+                for i, fr in group:
+                    raw = blob[fr["offset"] - start: fr["offset"] - start + fr["length"]]
+                    f.write(ciphers[fr["salt"]].decrypt(raw[:12], raw[12:], _frame_aad(entry["path"], i)))
+                del blob
+        if target.stat().st_size != entry["size"]:
+            raise SyntheticError(f"Size mismatch restoring {entry['path']}")
+        os.utime(target, (entry["mtime"], entry["mtime"]))
+    logger.info("Restored synthetic full %s to %s", key, root)
+    return root
@@ -11,20 +11,45 @@ from botocore.exceptions import BotoCoreError, ClientError
 from boto3.s3.transfer import TransferConfig
 
 from .logging_config import setup_logging
+from .governor import ResourceGovernor
 
 logger = setup_logging()
 
 
-def upload_file_multipart(file_path: Path, bucket: str, key: str, region: Optional[str] = None, retries: int = 5) -> None:
-    s3 = boto3.client("s3", region_name=region)
+DEFAULT_CHUNKSIZE = 16 * 1024 * 1024
+DEFAULT_CONCURRENCY = 10
 
-    config = TransferConfig(multipart_threshold=50 * 1024 * 1024, multipart_chunksize=16 * 1024 * 1024)
+
+def make_transfer_config(chunksize: int = DEFAULT_CHUNKSIZE, max_concurrency: int = DEFAULT_CONCURRENCY, threshold: int = 50 * 1024 * 1024) -> TransferConfig:
+    return TransferConfig(multipart_threshold=threshold, multipart_chunksize=chunksize, max_concurrency=max_concurrency)
+
+
+def s3_client(region: Optional[str] = None, endpoint_url: Optional[str] = None):
+    """S3 client; ``endpoint_url`` points at a local S3 stand-in (e.g. MinIO) for testing."""
+    return boto3.client("s3", region_name=region, endpoint_url=endpoint_url)
+
+
+def upload_file_multipart(
+    file_path: Path,
+    bucket: str,
+    key: str,
+    region: Optional[str] = None,
+    retries: int = 5,
+    governor: Optional[ResourceGovernor] = None,
+    chunksize: int = DEFAULT_CHUNKSIZE,
+    max_concurrency: int = DEFAULT_CONCURRENCY,
+    endpoint_url: Optional[str] = None,
+) -> None:
+    s3 = s3_client(region, endpoint_url)
+    callback = governor.upload_callback if governor else None
+
+    config = make_transfer_config(chunksize, max_concurrency)
 
     attempt = 0
     while True:
         try:
             logger.info("Uploading %s to s3://%s/%s", file_path, bucket, key)
-            s3.upload_file(str(file_path), bucket, key, Config=config)
+            s3.upload_file(str(file_path), bucket, key, Config=config, Callback=callback)
             logger.info("Upload successful: s3://%s/%s", bucket, key)
             return
         except (BotoCoreError, ClientError) as e:
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import os
+import sys
 from pathlib import Path
 import stat
 from typing import List
@@ -19,6 +20,21 @@ def normalize_path(p: str) -> Path:
     return Path(p)
 
 
+def is_network_path(p: Path) -> bool:
+    """True for UNC paths (\\\\server\\share) and, on Windows, drive letters mapped to a share."""
+    s = str(p)
+    if s.startswith("\\\\") or s.startswith("//"):
+        return True
+    if sys.platform == "win32":
+        import ctypes
+
+        drive = os.path.splitdrive(os.path.abspath(s))[0]
+        if drive:
+            DRIVE_REMOTE = 4
+            return ctypes.windll.kernel32.GetDriveTypeW(drive + "\\") == DRIVE_REMOTE
+    return False
+
+
 def check_permissions(p: Path) -> bool:
     # Basic read/write check: attempt to list and create a temp file
     try:
@@ -42,9 +58,8 @@ def validate_data_dir(data_path: Path) -> List[Path]:
     if not p.exists():
         raise ValidationError(f"Data directory not found: {p}")
 
-    # If UNC path (starts with \\), warn
-    if str(p).startswith("\\\\"):
-        logger.warning("Data path appears to be a network share. Agent should preferably run on the server hosting the share.")
+    if is_network_path(p):
+        logger.warning("Data path appears to be a network share; using polling scanner. Agent should preferably run on the server hosting the share.")
 
     check_permissions(p)
 
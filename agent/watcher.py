@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Callable, Optional
 
@@ -9,34 +10,61 @@ import psutil
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
-from .logging_config import setup_logging
+from .logging_config import setup_logging, EventSampler
 
 logger = setup_logging()
 
 
+def tally_running() -> bool:
+    for p in psutil.process_iter(attrs=["name"]):
+        try:
+            name = p.info.get("name", "")
+            if name and name.lower().startswith("tally"):
+                return True
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    return False
+
+
 class DebounceHandler(FileSystemEventHandler):
     def __init__(self, callback: Callable[[], None], debounce_seconds: int = 120):
         self.callback = callback
         self.debounce_seconds = debounce_seconds
         self._timer: Optional[threading.Timer] = None
+        # Tally writes produce bursts of events; log a periodic summary, not one line each
+        self._sampler = EventSampler(logger, "Filesystem events")
 
     def _reset_timer(self):
         if self._timer and self._timer.is_alive():
             self._timer.cancel()
-        self._timer = threading.Timer(self.debounce_seconds, self.callback)
+        self._timer = threading.Timer(self.debounce_seconds, self._fire)
         self._timer.daemon = True
         self._timer.start()
 
+    def _fire(self):
+        self._sampler.flush()
+        self.callback()
+
     def on_any_event(self, event):
-        logger.debug("Filesystem event: %s", event)
+        self._sampler.record(event.event_type)
         self._reset_timer()
 
 
 class Watcher:
-    def __init__(self, data_path: Path, backup_callback: Callable[[Path], None], debounce_seconds: int = 120):
+    def __init__(
+        self,
+        data_path: Path,
+        backup_callback: Callable[[Path], None],
+        debounce_seconds: int = 120,
+        max_workers: int = 1,
+        scan_complete_callback: Optional[Callable[[], None]] = None,
+    ):
         self.data_path = data_path
         self.backup_callback = backup_callback
+        self.scan_complete_callback = scan_complete_callback
         self.debounce_seconds = debounce_seconds
+        self.max_workers = max(1, max_workers)
+        self._scan_lock = threading.Lock()
         self.observer = Observer()
         self._stop = threading.Event()
         self._monitor_thread: Optional[threading.Thread] = None
@@ -53,24 +81,22 @@ class Watcher:
 
     def _on_debounced(self):
         logger.info("Debounce period elapsed; triggering backup scan")
-        # Walk companies and call backup_callback on each
-        for d in self.data_path.iterdir():
-            if d.is_dir():
-                self.backup_callback(d)
+        # Debounce timer and process monitor can both fire; never run two scans at once
+        with self._scan_lock:
+            companies = [d for d in self.data_path.iterdir() if d.is_dir()]
+            if self.max_workers == 1:
+                for d in companies:
+                    self.backup_callback(d)
+            else:
+                with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="backup") as pool:
+                    list(pool.map(self.backup_callback, companies))
+            if self.scan_complete_callback:
+                self.scan_complete_callback()
 
     def _process_monitor_loop(self):
         # If Tally process stops, trigger immediate backup
         while not self._stop.is_set():
-            found = False
-            for p in psutil.process_iter(attrs=["name"]):
-                try:
-                    name = p.info.get("name", "")
-                    if name and name.lower().startswith("tally"):
-                        found = True
-                        break
-                except (psutil.NoSuchProcess, psutil.AccessDenied):
-                    continue
-            if not found:
+            if not tally_running():
                 logger.info("Tally process not found; triggering immediate backup")
                 self._on_debounced()
                 # wait a bit to avoid tight loop